@@ -1,10 +1,13 @@
 import json
 from pathlib import Path
 from datetime import datetime
-from run_analyzer import analyze_run, load_baseline, compute_baseline, load_past_runs, is_valid_run
+from run_analyzer import analyze_run, load_baseline, compute_baseline
+from utils.load_runs_by_date import load_runs_from_db
+from utils.parser import parse_activity
+from utils.strava_db import connect
+from utils.archive import load_archived_activity
 
 DATA_DIR = Path("data")
-RAW_FILE = DATA_DIR / "strava_2025-07-11.json"
 ANALYZED_FILE = DATA_DIR / "strava_analyzed.json"
 
 # Prompt user
@@ -12,19 +15,26 @@ target_id_input = input("Enter the Strava activity ID: ")
 target_id = int(target_id_input)
 
 # Load raw data
-with open(RAW_FILE) as f:
-    activities = json.load(f)
+raw = load_archived_activity(target_id)
+if not raw:
+    conn = connect()
+    known = conn.execute("SELECT 1 FROM activities WHERE id = ?", (target_id,)).fetchone()
+    conn.close()
+    if known:
+        print(f"Run with ID {target_id} is in the database but not archived. Archive it with strava_importer.py --archive_dump.")
+    else:
+        print(f"Run with ID {target_id} not found.")
+    exit(1)
 
-run = next((a for a in activities if a["id"] == target_id), None)
+run = parse_activity(raw)
 if not run:
-    print(f"Run with ID {target_id} not found.")
     exit(1)
 
 # Load or compute baseline
 baseline = load_baseline()
 if not baseline:
     print("No baseline found. Computing baseline...")
-    all_runs = load_past_runs()
+    all_runs = load_runs_from_db()
     baseline = compute_baseline(all_runs)
 
 # Analyze run
@@ -34,7 +44,7 @@ summary = analyze_run(run, baseline)
 entry = {
     "id": run["id"],
     "name": run["name"],
-    "date": run["start_date"],
+    "date": run["start_date"].isoformat(),
     "summary": summary
 }
 
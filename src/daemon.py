@@ -0,0 +1,215 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from graphlib import TopologicalSorter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import requests
+from strava_importer import load_config, refresh_access_token
+from run_analyzer import compute_baseline, load_baseline, save_baseline
+from utils.strava_db import connect, save_activities, get_activities, get_activity, get_activity_streams, save_streams, load_streams
+from utils.parser import parse_activity
+from utils.archive import archive_activities
+from utils.duplicates import index_activities
+from utils.routes import save_routes
+from utils.best_efforts import compute_best_efforts, save_best_efforts, rebuild_envelope
+from utils.zones import compute_zones, save_zones
+from utils.load_runs_by_date import load_runs_from_db, is_valid_run
+from utils.hr import get_baseline_hr
+from utils.banister import daily_series, fit_model, responses
+from utils.quantiles import update_sketches, load_sketches
+
+POLL_INTERVAL = 15 * 60  # seconds between Strava polls when no webhook events arrive
+POLL_OVERLAP = timedelta(days=3)  # re-request this far back to catch late syncs (e.g. the watch copy of a phone upload)
+
+
+class Pipeline:
+    # Each stage takes the set of activity IDs that changed upstream and
+    # returns the IDs it changed. Stages run in dependency order and are
+    # skipped when none of their inputs changed. Helpers don't commit on a
+    # passed-in connection, so a run is one transaction: if any stage fails,
+    # nothing is kept and the same activities come back as new next time.
+
+    def __init__(self, token):
+        self.token = token
+        self.conn = connect()
+        self.baseline = load_baseline()
+        self.model = None
+        self.stages = {
+            "import": ([], self.import_activities),
+            "streams": (["import"], self.fetch_streams),
+            "best_efforts": (["streams"], self.update_best_efforts),
+            "baseline": (["import"], self.update_baseline),
+            "zones": (["streams", "baseline"], self.update_zones),
+            "training_load": (["import", "baseline"], self.update_training_load),
+        }
+        self.order = list(TopologicalSorter({name: deps for name, (deps, _) in self.stages.items()}).static_order())
+
+    def run(self, activities: list[dict], replace=False):
+        changed = {"source": {a["id"] for a in activities}}
+        self.pending = activities
+        self.replace = replace
+        for name in self.order:
+            deps, stage = self.stages[name]
+            inputs = set().union(*(changed.get(d, set()) for d in deps or ["source"]))
+            if not inputs:
+                changed[name] = set()
+                continue
+            started = time.perf_counter()
+            changed[name] = stage(inputs)
+            print(f"  {name}: {len(changed[name])} changed ({time.perf_counter() - started:.2f}s)")
+        self.conn.commit()
+
+    def import_activities(self, ids):
+        # Re-delivered webhooks and the poll boundary hand back activities we
+        # already have; only new or changed rows flow downstream
+        parsed = [p for p in (parse_activity(a) for a in self.pending) if p is not None]
+        changed = save_activities(parsed, self.conn, replace=self.replace)
+        parsed = [p for p in parsed if p["id"] in changed]
+        archive_activities([a for a in self.pending if a["id"] in changed], self.conn)
+        save_routes(parsed, self.conn)
+        if index_activities(parsed, self.conn):
+            rebuild_envelope(self.conn)  # a newly flagged copy may hold all-time bests
+        update_sketches(changed, self.conn, replaced=self.replace)
+        return changed
+
+    def fetch_streams(self, ids):
+        fetched = set()
+        for activity_id in ids:
+            try:
+                streams = get_activity_streams(self.token, activity_id)
+            except requests.HTTPError as e:
+                print(f"  streams: skipping {activity_id}: {e}")
+                continue
+            save_streams(activity_id, streams, self.conn)
+            fetched.add(activity_id)
+        return fetched
+
+    def update_best_efforts(self, ids):
+        for activity_id in ids:
+            save_best_efforts(activity_id, compute_best_efforts(load_streams(activity_id, self.conn)), self.conn)
+        return ids
+
+    def update_baseline(self, ids):
+        # The cached baseline only moves when a valid run arrives
+        runs = load_runs_from_db(self.conn)
+        if not any(is_valid_run(r) for r in runs if r["id"] in ids) and self.baseline:
+            return set()
+        self.baseline = compute_baseline(runs, load_sketches(conn=self.conn))
+        save_baseline(self.baseline)
+        return ids
+
+    def update_zones(self, ids):
+        if not self.baseline:
+            return set()
+        # A new baseline shifts the zone edges, but only re-bin what changed;
+        # older activities keep the edges they were binned with.
+        for activity_id in ids:
+            streams = load_streams(activity_id, self.conn)
+            save_zones(activity_id, compute_zones(streams, self.baseline), self.conn)
+        return ids
+
+    def update_training_load(self, ids):
+        if not self.baseline:
+            return set()
+        max_hr, resting_hr = get_baseline_hr(self.baseline)
+        runs = [r for r in load_runs_from_db(self.conn) if is_valid_run(r)]
+        _, load, perf = daily_series(runs, max_hr, resting_hr)
+        try:
+            self.model = fit_model(load, perf)
+        except ValueError as e:
+            print(f"  training_load: {e}")
+            return set()
+        fitness = responses(load, np.array([self.model["tau1"]]))[0, -1]
+        fatigue = responses(load, np.array([self.model["tau2"]]))[0, -1]
+        print(f"  training_load: fitness {fitness:.0f}, fatigue {fatigue:.0f}")
+        return ids
+
+    def poll_after(self) -> datetime | None:
+        # Activities can sync after newer ones; save_activities drops the
+        # ones the overlap brings back again
+        row = self.conn.execute("SELECT MAX(start_date) FROM activities").fetchone()
+        return datetime.fromisoformat(row[0]) - POLL_OVERLAP if row and row[0] else None
+
+
+def make_webhook_handler(events: queue.Queue):
+    # Local stand-in for Strava push subscriptions: POST the same JSON body
+    # Strava would send ({"object_type", "object_id", "aspect_type"}).
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            # Subscription validation handshake
+            challenge = parse_qs(urlparse(self.path).query).get("hub.challenge", [""])[0]
+            body = json.dumps({"hub.challenge": challenge}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            try:
+                event = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            except json.JSONDecodeError:
+                self.send_response(400)
+                self.end_headers()
+                return
+            if event.get("object_type", "activity") == "activity" and event.get("aspect_type") in ("create", "update"):
+                events.put((int(event["object_id"]), event["aspect_type"]))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return WebhookHandler
+
+
+def main():
+    parser = argparse.ArgumentParser("Keep the database and analyses up to date as activities arrive")
+    parser.add_argument("--poll_interval", type=int, default=POLL_INTERVAL, help="Seconds between Strava polls")
+    parser.add_argument("--webhook_port", type=int, default=None, help="Also accept webhook events on this local port")
+    args = parser.parse_args()
+
+    config = load_config()
+    pipeline = Pipeline(refresh_access_token(config))
+    events = queue.Queue()
+
+    if args.webhook_port:
+        server = ThreadingHTTPServer(("127.0.0.1", args.webhook_port), make_webhook_handler(events))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Listening for webhook events on http://127.0.0.1:{args.webhook_port}")
+
+    next_poll = 0.0
+    try:
+        while True:
+            try:
+                event = events.get(timeout=max(next_poll - time.monotonic(), 0))
+            except queue.Empty:
+                event = None
+
+            # A deleted or private activity (404), a dropped connection or a
+            # failing stage only loses this event or poll, not the daemon
+            try:
+                if event:
+                    activity_id, aspect = event
+                    print(f"Webhook: {aspect} {activity_id}")
+                    pipeline.run([get_activity(pipeline.token, activity_id)], replace=aspect == "update")
+                else:
+                    next_poll = time.monotonic() + args.poll_interval
+                    pipeline.token = refresh_access_token(config)
+                    activities = get_activities(pipeline.token, after=pipeline.poll_after())
+                    if activities:
+                        print(f"Poll: {len(activities)} activities fetched")
+                        pipeline.run(activities)
+            except Exception as e:
+                pipeline.conn.rollback()
+                print(f"{'Webhook' if event else 'Poll'} failed: {e}")
+    except KeyboardInterrupt:
+        print("Stopping.")
+
+
+if __name__ == "__main__":
+    main()
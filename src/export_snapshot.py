@@ -0,0 +1,18 @@
+import argparse
+from pathlib import Path
+from utils.snapshot import export_snapshot, SNAPSHOT_DIR, FORMATS
+
+
+def main():
+    parser = argparse.ArgumentParser("Export activities, derived metrics and streams as a partitioned snapshot")
+    parser.add_argument("--format", type=str, help="Snapshot file format", default="arrow", choices=list(FORMATS))
+    parser.add_argument("--out", type=str, help="Snapshot directory", default=str(SNAPSHOT_DIR))
+    args = parser.parse_args()
+
+    counts = export_snapshot(Path(args.out), args.format)
+    for name, rows in counts.items():
+        print(f"Exported {rows} {name} rows to {Path(args.out) / name}")
+
+
+if __name__ == "__main__":
+    main()
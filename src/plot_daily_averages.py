@@ -1,11 +1,12 @@
-import sqlite3
 import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime
 from pathlib import Path
 import yaml
 import argparse
-from utils.strava_db import DB_PATH
+from utils.strava_db import DB_PATH, connect
+from utils.duplicates import NOT_DUPLICATE
+from utils.fitting import fit_trend, METHODS
 import numpy as np
 
 
@@ -61,9 +62,20 @@ def map_field(key: str) -> str:
         raise ValueError(f"Invalid field: {key}")
     return mapping[key]
 
-def load_daily_averages():
-    conn = sqlite3.connect(DB_PATH)
-    query = """
+def map_weight(key: str) -> str | None:
+    mapping = {
+        "none": None,
+        "distance": "avg_distance",
+        "moving_time": "avg_moving_time",
+    }
+    if key not in mapping:
+        raise ValueError(f"Invalid weight: {key}")
+    return mapping[key]
+
+def load_daily_averages(route_id=None):
+    conn = connect()
+    route_filter = "AND id IN (SELECT activity_id FROM activity_routes WHERE route_id = ?)" if route_id is not None else ""
+    query = f"""
         SELECT 
             DATE(start_date) as day,
             AVG(distance) / 1000.0 as avg_distance,
@@ -73,11 +85,11 @@ def load_daily_averages():
             AVG(max_hr) as max_hr,
             AVG(total_elevation_gain) / 1000.0 as avg_elevation
         FROM activities
-        WHERE distance > 1000
+        WHERE distance > 1000 AND {NOT_DUPLICATE} {route_filter}
         GROUP BY day
         ORDER BY day
     """
-    df = pd.read_sql_query(query, conn, parse_dates=["day"])
+    df = pd.read_sql_query(query, conn, params=(route_id,) if route_id is not None else None, parse_dates=["day"])
     conn.close()
     return df
 
@@ -144,7 +156,7 @@ def plot_metric(df, x_values, y_values, theme):
     plt.gca().spines['right'].set_color(theme["grid_color"])
 
 
-def trend_line(df, x_values, y_values, theme, y_offset):
+def trend_line(df, x_values, y_values, theme, y_offset, method="ols", weights_col=None):
     df = df.sort_values(by=x_values)
 
     x = df[x_values].values
@@ -159,14 +171,15 @@ def trend_line(df, x_values, y_values, theme, y_offset):
     x_float = np.asarray(x_float, dtype=np.float64)
     y = np.asarray(y, dtype=np.float64)
 
-    z = np.polyfit(x_float, y, 1)
+    weights = df[weights_col].values if weights_col else None
+    z = fit_trend(x_float, y, 1, method, weights)
     p = np.poly1d(z)
 
     # Plot trend line
     plt.plot(
         df[x_values],
         p(x_float),
-        label="Average Trend",
+        label="Average Trend" if method == "ols" else f"Average Trend ({method})",
         color=theme["trend_line_color"],
         linestyle=theme["trend_line_style"],
         linewidth=theme["trend_line_width"],
@@ -201,7 +214,7 @@ def trend_line(df, x_values, y_values, theme, y_offset):
 
     return y_offset - 0.03
 
-def curve_fit_trend(df, x_values, y_values, degree, theme, y_offset):
+def curve_fit_trend(df, x_values, y_values, degree, theme, y_offset, method="ols", weights_col=None):
     df = df.sort_values(by=x_values)
 
     x = df[x_values].values
@@ -217,14 +230,15 @@ def curve_fit_trend(df, x_values, y_values, degree, theme, y_offset):
     y = np.asarray(y, dtype=np.float64)
 
     # Fit a curve of the given degree
-    coeffs = np.polyfit(x_float, y, degree)
+    weights = df[weights_col].values if weights_col else None
+    coeffs = fit_trend(x_float, y, degree, method, weights)
     poly = np.poly1d(coeffs)
 
     # Plot the curve
     plt.plot(
         x_plot,
         poly(x),
-        label="Data Curve",
+        label="Data Curve" if method == "ols" else f"Data Curve ({method})",
         color=theme["curve_fit_color"],
         linestyle=theme["curve_fit_style"],
         linewidth=theme["curve_fit_width"],
@@ -255,36 +269,39 @@ def curve_fit_trend(df, x_values, y_values, degree, theme, y_offset):
 
     return y_offset - 0.03
 
-def plot_all_segmented_trends(df, x_col, y_col, theme, y_offset, segment_size=4):
+def plot_all_segmented_trends(df, x_col, y_col, theme, y_offset, segment_size=4, method="ols", weights_col=None):
     df = df.sort_values(by=x_col)
     num_chunks = len(df) // segment_size
+    if num_chunks == 0 or segment_size < 2:
+        return y_offset
 
     pastel_palette = [
         "#a6daff", "#c6a0f6", "#f5bde6", "#f0c6c6", "#b5e8e0",
         "#f28fad", "#d2d2ff", "#e8d6ff", "#ffe5b4", "#ffd6e0"
     ]
 
-    for i in range(num_chunks):
-        chunk = df.iloc[i * segment_size:(i + 1) * segment_size]
-        if len(chunk) < 2:
-            continue
-
-        x = chunk[x_col].values
-        y = chunk[y_col].values
+    df = df.iloc[:num_chunks * segment_size]
+    x = df[x_col].values
+    if np.issubdtype(x.dtype, np.datetime64):
+        x_float = x.astype("datetime64[D]").astype(float)
+    else:
+        x_float = np.asarray(x, dtype=np.float64)
 
-        if np.issubdtype(x.dtype, np.datetime64):
-            x_float = x.astype("datetime64[D]").astype(float)
-        else:
-            x_float = x
+    # Fit every segment in one batch: each row is one segment
+    x_float = x_float.reshape(num_chunks, segment_size)
+    y = df[y_col].values.astype(np.float64).reshape(num_chunks, segment_size)
+    weights = df[weights_col].values.reshape(num_chunks, segment_size) if weights_col else None
+    segment_coeffs = fit_trend(x_float, y, 1, method, weights)
 
-        z = np.polyfit(x_float, y, 1)
-        p = np.poly1d(z)
+    for i in range(num_chunks):
+        chunk = df.iloc[i * segment_size:(i + 1) * segment_size]
+        p = np.poly1d(segment_coeffs[i])
 
         color = pastel_palette[i % len(pastel_palette)]
 
         plt.plot(
             chunk[x_col],
-            p(x_float),
+            p(x_float[i]),
             color=color,
             linestyle="--",
             linewidth=2,
@@ -319,12 +336,19 @@ def main():
     parser.add_argument("--trend_line", action="store_true", help="Plot the trend line")
     parser.add_argument("--curve_fit", action="store_true", help="Plot the curve fit")
     parser.add_argument("--segmented_trends", type=int, help="Plot the segmented trends", default=4, choices=[4, 7, 14, 28])
+    parser.add_argument("--fit_method", type=str, help="Trend fitting method", default="ols", choices=METHODS)
+    parser.add_argument("--weight_by", type=str, help="Weight trend fits by run distance or moving time", default="none", choices=["none", "distance", "moving_time"])
+    parser.add_argument("--route", type=int, help="Only plot runs on this route ID", default=None)
     parser.add_argument("--save", action="store_true", help="Save the plot")
     args = parser.parse_args()
 
+    if args.curve_fit and args.fit_method == "theil_sen":
+        parser.error("--curve_fit does not support theil_sen, use ols or huber")
+
     # Map the fields
     x_values = map_field(args.x)
     y_values = map_field(args.y)
+    weights_col = map_weight(args.weight_by)
 
     if x_values == y_values:
         raise ValueError("X and Y values cannot be the same")
@@ -333,7 +357,10 @@ def main():
     theme = config["theme"] # type: ignore
 
     # Load the data
-    df = load_daily_averages()
+    df = load_daily_averages(args.route)
+    if df.empty:
+        print("No runs found to plot.")
+        return
     style_plot(theme)
 
     if args.group_by == "week": # type: ignore
@@ -352,16 +379,16 @@ def main():
     equation_y = 0.95 # type: ignore
     
     if args.trend_line:
-        equation_y = trend_line(df, x_values, y_values, theme, equation_y)
+        equation_y = trend_line(df, x_values, y_values, theme, equation_y, args.fit_method, weights_col)
 
     if args.curve_fit:
-        equation_y = curve_fit_trend(df, x_values, y_values, 2, theme, equation_y)
+        equation_y = curve_fit_trend(df, x_values, y_values, 2, theme, equation_y, args.fit_method, weights_col)
 
     if args.save:
         plt.savefig(f"plots/{x_values}_{y_values}_{args.group_by}.png")
 
     if args.segmented_trends:
-        equation_y = plot_all_segmented_trends(df, x_values, y_values, theme, equation_y, int(args.segmented_trends))
+        equation_y = plot_all_segmented_trends(df, x_values, y_values, theme, equation_y, int(args.segmented_trends), args.fit_method, weights_col)
 
     plt.legend(loc="upper right", frameon=True, facecolor=theme["background_color"], edgecolor=theme["grid_color"], fontsize=16)
     plt.tight_layout(rect=[0, 0, 1, 0.95])
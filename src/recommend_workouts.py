@@ -0,0 +1,50 @@
+import argparse
+from datetime import date, datetime
+import numpy as np
+from run_analyzer import load_baseline, compute_baseline
+from utils.load_runs_by_date import load_runs_from_db, is_valid_run
+from utils.hr import get_baseline_hr
+from utils.banister import daily_series, fit_model, predict, recommend
+
+
+def main():
+    parser = argparse.ArgumentParser("Recommend multi-week training plans for a target date")
+    parser.add_argument("--target", type=str, required=True, help="Target (race) date, YYYY-MM-DD")
+    parser.add_argument("--plans", type=int, default=5000, help="Number of candidate plans to simulate")
+    parser.add_argument("--top", type=int, default=5, help="Number of plans to show")
+    args = parser.parse_args()
+
+    target = datetime.strptime(args.target, "%Y-%m-%d").date()
+    days = (target - date.today()).days
+    if days < 1:
+        print("Target date must be in the future.")
+        return
+
+    runs = [r for r in load_runs_from_db() if is_valid_run(r)]
+    baseline = load_baseline()
+    if not baseline:
+        print("No baseline found. Computing baseline...")
+        baseline = compute_baseline(runs)
+    max_hr, resting_hr = get_baseline_hr(baseline)
+
+    _, load, perf = daily_series(runs, max_hr, resting_hr)
+    try:
+        model = fit_model(load, perf)
+    except ValueError as e:
+        print(e)
+        return
+    print(f"Fitted model: tau fitness {model['tau1']:.0f}d, tau fatigue {model['tau2']:.0f}d, "
+          f"k1 {model['k1']:.4f}, k2 {model['k2']:.4f}, RMSE {model['rmse']:.2f}")
+
+    current = predict(model, load, np.zeros((1, days - 1)))[0]
+    print(f"Predicted performance on {target} with no training: {current:.2f}\n")
+
+    for rank, plan in enumerate(recommend(model, load, days, args.plans, args.top), start=1):
+        print(f"#{rank}: predicted performance {plan['predicted_performance']:.2f}")
+        for week, details in enumerate(plan["weeks"], start=1):
+            print(f"  Week {week} (load {details['load']:.0f}): {', '.join(details['workouts'])}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,8 +10,12 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import sqlite3
 from utils.strava_db import DB_PATH
-from utils.load_runs_by_date import load_runs_by_date, load_runs_from_db, is_valid_run
+from utils.load_runs_by_date import load_runs_by_date, load_runs_from_db, load_runs_for_route, is_valid_run
 from utils.vo2 import calculate_vo2_max, parse_vo2_max
+from utils.zones import load_zones, format_zones
+from utils.routes import get_route_id
+from utils.best_efforts import load_best_efforts, load_envelope, STANDARD_DISTANCES
+from utils.quantiles import build_sketches, sketch_percentiles, load_sketches, PERCENTILES
 
 DATA_DIR = Path("data").resolve().parents[1] / "data"
 BASELINE_FILE = DATA_DIR / "baseline.json"
@@ -27,8 +31,11 @@ def load_baseline() -> dict:
 
 
 
-def compute_baseline(runs: list[dict]) -> dict:
+def compute_baseline(runs: list[dict], sketches: dict = None) -> dict:
     runs = [r for r in runs if is_valid_run(r)]
+    # Percentiles come from the persisted quantile sketches when given,
+    # otherwise from sketches built over these runs
+    sketches = sketches or build_sketches(runs)
 
     for run in runs:
         resting_hr = run.get("resting_hr", 41.0)
@@ -39,7 +46,7 @@ def compute_baseline(runs: list[dict]) -> dict:
         else:
             run["vo2_max"] = calculate_vo2_max(run["average_speed"], max_hr, resting_hr, average_hr)
 
-    return {
+    baseline = {
         "avg_distance": mean(r["distance"] for r in runs),
         "avg_moving_time": mean(r["moving_time"] for r in runs),
         "avg_speed": mean(r["average_speed"] for r in runs),
@@ -52,8 +59,27 @@ def compute_baseline(runs: list[dict]) -> dict:
         "avg_elevation_gain_per_moving_time": mean(r["total_elevation_gain"] / r["moving_time"] for r in runs if r["moving_time"] > 0),
         "avg_vo2_max": parse_vo2_max(runs)
     }
-
-def analyze_run(new_run: dict, baseline: dict) -> str:
+    baseline.update(sketch_percentiles(sketches))
+    return baseline
+
+def format_percentiles(new_run: dict, baseline: dict) -> str:
+    # Older baseline files predate the percentile keys
+    values = {
+        "pace_min_per_km": new_run["moving_time"] / (new_run["distance"] / 1000),
+        "heart_rate": new_run.get("average_hr"),
+        "distance": new_run["distance"],
+        "elevation_gain_per_km": new_run["total_elevation_gain"] / (new_run["distance"] / 1000),
+    }
+    lines = []
+    for metric, value in values.items():
+        bands = [baseline.get(f"p{p}_{metric}") for p in PERCENTILES]
+        if value is None or None in bands:
+            continue
+        band_text = ", ".join(f"p{p} {b:.2f}" for p, b in zip(PERCENTILES, bands))
+        lines.append(f"      {metric}: {value:.2f} ({band_text})")
+    return "\n".join(lines)
+
+def analyze_run(new_run: dict, baseline: dict, zones: dict = None) -> str:
     pace = new_run["moving_time"] / (new_run["distance"] / 1000)  # seconds per km
     pace_min = int(pace // 60)
     pace_sec = int(pace % 60)
@@ -90,9 +116,56 @@ def analyze_run(new_run: dict, baseline: dict) -> str:
       Δ Elevation Gain per moving time: {new_run["total_elevation_gain"] / new_run["moving_time"] - baseline["avg_elevation_gain_per_moving_time"]:.2f} m/min ({(new_run["total_elevation_gain"] / new_run["moving_time"] - baseline["avg_elevation_gain_per_moving_time"]) / baseline["avg_elevation_gain_per_moving_time"] * 100:.2f}%)
       Δ VO2 Max: {new_run.get("vo2_max", "N/A") - baseline["avg_vo2_max"]:.2f} ({(new_run.get("vo2_max", "N/A") - baseline["avg_vo2_max"]) / baseline["avg_vo2_max"] * 100:.2f}%)
     """
+    percentiles = format_percentiles(new_run, baseline)
+    if percentiles:
+        summary += f"""Compared to baseline percentiles:
+{percentiles}
+    """
+    if zones:
+        summary += f"""Time in zones:
+    {format_zones(zones)}
+    """
     return summary
 
-
+def format_best_efforts(best_efforts: dict, envelope: list[tuple]) -> str:
+    # Fastest standard distances in this run against the all-time bests
+    records = {key: (value, activity_id) for key, value, activity_id in envelope}
+    lines = []
+    for name, meters in STANDARD_DISTANCES.items():
+        seconds = best_efforts.get("distance", {}).get(meters)
+        if seconds is None:
+            continue
+        line = f"      {name}: {int(seconds // 60)}:{int(seconds % 60):02d}"
+        if meters in records:
+            best, activity_id = records[meters]
+            line += " (all-time best)" if seconds <= best else f" (all-time best {int(best // 60)}:{int(best % 60):02d}, activity {activity_id})"
+        lines.append(line)
+    return "\n".join(lines)
+
+def analyze_route(new_run: dict, route_runs: list[dict]) -> str:
+    previous = [r for r in route_runs if r["id"] != new_run["id"] and r["start_date"] < new_run["start_date"]]
+    if not previous:
+        return "    First run on this route.\n"
+
+    # Only speed is compared, so phone recordings without HR still count
+    speed = new_run.get("average_speed")
+    route_speeds = [r["average_speed"] for r in previous if r.get("average_speed")]
+    if not speed or not route_speeds:
+        return f"    Route: {len(previous)} previous runs, no speed data to compare.\n"
+
+    route_speed = mean(route_speeds)
+    run_date = datetime.fromisoformat(new_run["start_date"])
+    last_month = [r["average_speed"] for r in previous
+                  if r.get("average_speed") and (run_date - datetime.fromisoformat(r["start_date"])).days <= 30]
+
+    summary = f"""    Route: {len(previous)} previous runs
+      Δ Speed vs route baseline: {(speed - route_speed) * 3.6:.2f} km/h ({(speed - route_speed) / route_speed * 100:.2f}%)
+    """
+    if last_month:
+        month_speed = mean(last_month)
+        summary += f"""  Δ Speed vs last 30 days on route: {(speed - month_speed) * 3.6:.2f} km/h ({(speed - month_speed) / month_speed * 100:.2f}%)
+    """
+    return summary
 
 
 def main():
@@ -109,7 +182,7 @@ def main():
         print("moving_time values:", [r.get("moving_time") for r in all_runs])
         print("distance values:", [r.get("distance") for r in all_runs])
         print("vo2_max values:", [r.get("vo2_max") for r in all_runs])
-        baseline = compute_baseline(all_runs)
+        baseline = compute_baseline(all_runs, load_sketches())
         save_baseline(baseline)
         print("Baseline refreshed successfully.")
         return
@@ -137,7 +210,13 @@ def main():
             save_baseline(baseline)
 
         for run in today_runs:
-            print(analyze_run(run, baseline))
+            print(analyze_run(run, baseline, load_zones(run["id"])))
+            best_efforts = format_best_efforts(load_best_efforts(run["id"]), load_envelope("distance"))
+            if best_efforts:
+                print(f"    Best efforts:\n{best_efforts}")
+            route_id = get_route_id(run["id"])
+            if route_id is not None:
+                print(analyze_route(run, load_runs_for_route(route_id)))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -6,7 +6,14 @@ from utils.save_json import save_json, load_json
 from datetime import datetime, timedelta
 from pathlib import Path
 from utils.parser import parse_activity
-from utils.strava_db import create_db, save_activities, DB_PATH, get_activities, get_new_activities
+from utils.strava_db import create_db, save_activities, DB_PATH, get_activities, get_new_activities, get_activity_streams, save_streams
+from utils.best_efforts import compute_best_efforts, save_best_efforts, rebuild_envelope
+from utils.archive import archive_activities, archive_json_dump, iter_archived_activities
+from utils.zones import compute_zones, save_zones
+from utils.duplicates import index_activities, deduplicate_history
+from utils.routes import save_routes, cluster_routes
+from utils.quantiles import update_sketches, rebuild_sketches
+from run_analyzer import load_baseline
 
 
 CONFIG_PATH = Path("config/strava.yaml").resolve().parents[2] / "config" / "strava.yaml"
@@ -27,6 +34,10 @@ def refresh_access_token(config):
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--all", action="store_true", help="Import full activity history")
+    parser.add_argument("--streams", action="store_true", help="Fetch per-second streams and compute best efforts")
+    parser.add_argument("--archive_dump", type=str, help="Archive an existing full-history JSON dump and exit")
+    parser.add_argument("--dedupe", action="store_true", help="Flag overlapping duplicate activities across the whole history and exit")
+    parser.add_argument("--routes", action="store_true", help="Re-cluster routes from archived polylines and exit")
     args = parser.parse_args()
 
     if not DATA_DIR.exists():
@@ -38,6 +49,21 @@ def main():
     else:
         print("Database already exists.")
 
+    if args.archive_dump:
+        archive_json_dump(args.archive_dump)
+        return
+
+    if args.dedupe:
+        print(f"Flagged {deduplicate_history()} duplicate activities.")
+        rebuild_sketches()
+        rebuild_envelope()
+        return
+
+    if args.routes:
+        polylines = {a['id']: (a.get('map') or {}).get('summary_polyline') for a in iter_archived_activities()}
+        print(f"Clustered activities into {cluster_routes(polylines)} routes.")
+        return
+
     config = load_config()
     token = refresh_access_token(config)
 
@@ -51,7 +77,32 @@ def main():
     if activities:
         print(f"Found {len(activities)} new activities.")
         parsed = [parse_activity(a) for a in activities if parse_activity(a) is not None]
-        save_activities(parsed)
+        inserted = save_activities(parsed)
+        archive_activities([a for a in activities if a['id'] in inserted])
+        save_routes(parsed)
+        flagged = index_activities(parsed)
+        update_sketches(inserted)
+        if flagged:
+            rebuild_envelope()
+            print(f"Flagged {flagged} overlapping activities as duplicates; they stay in the database but are left out of analyses.")
+
+        if args.streams:
+            print("Fetching streams and computing best efforts...")
+            baseline = load_baseline()
+            if not baseline:
+                print("No baseline found, skipping zones. Run run_analyzer.py refresh first.")
+            for a in parsed:
+                # Manual entries have no streams (404) and Strava rate-limits (429);
+                # skip that activity rather than losing the rest of the batch
+                try:
+                    streams = get_activity_streams(token, a['id'])
+                except requests.HTTPError as e:
+                    print(f"Skipping streams for {a['id']}: {e}")
+                    continue
+                save_streams(a['id'], streams)
+                save_best_efforts(a['id'], compute_best_efforts(streams))
+                if baseline:
+                    save_zones(a['id'], compute_zones(streams, baseline))
     else:
         print("No new activities found.")
 
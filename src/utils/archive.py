@@ -0,0 +1,109 @@
+import gzip
+import json
+from pathlib import Path
+from utils.strava_db import DB_PATH, connect
+from utils.save_json import load_json
+
+ARCHIVE_DIR = DB_PATH.parent / "archive"
+SEGMENT_SIZE = 16 * 1024 * 1024  # start a new segment once the current one passes this
+
+
+# Every payload is written as its own gzip member. Concatenated members are
+# still a valid .gz file, so a segment can be read end to end with gzip.open,
+# while the (segment, offset, length) index lets one activity be read back
+# with a single seek.
+
+
+def _segment_path(number: int) -> Path:
+    return ARCHIVE_DIR / f"segment_{number:05d}.json.gz"
+
+
+def _segment_number(segment: Path) -> int:
+    return int(segment.name.split("_")[1].split(".")[0])
+
+
+def _current_segment(conn) -> Path:
+    row = conn.execute("SELECT segment FROM archive_index ORDER BY segment DESC LIMIT 1").fetchone()
+    if row:
+        segment = ARCHIVE_DIR / row[0]
+        if segment.exists() and segment.stat().st_size < SEGMENT_SIZE:
+            return segment
+        number = _segment_number(segment) + 1
+    else:
+        number = 1
+    return _segment_path(number)
+
+
+def archive_activities(activities: list[dict], conn=None):
+    if not activities:
+        return
+
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    segment = _current_segment(conn)
+    f = open(segment, "ab")
+
+    entries = []
+    for activity in activities:
+        if f.tell() >= SEGMENT_SIZE:
+            f.close()
+            segment = _segment_path(_segment_number(segment) + 1)
+            f = open(segment, "ab")
+
+        payload = gzip.compress(json.dumps(activity, separators=(",", ":")).encode("utf-8"))
+        entries.append((activity["id"], segment.name, f.tell(), len(payload)))
+        f.write(payload)
+    f.close()
+
+    # Re-archiving an ID appends a new copy and repoints the index at it
+    conn.executemany("INSERT OR REPLACE INTO archive_index VALUES (?, ?, ?, ?)", entries)
+    if own_conn:
+        conn.commit()
+        conn.close()
+
+
+def load_archived_activity(activity_id: int, conn=None) -> dict | None:
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    row = conn.execute(
+        "SELECT segment, offset, length FROM archive_index WHERE activity_id = ?",
+        (activity_id,)
+    ).fetchone()
+    if own_conn:
+        conn.close()
+    if not row:
+        return None
+
+    segment, offset, length = row
+    with open(ARCHIVE_DIR / segment, "rb") as f:
+        f.seek(offset)
+        return json.loads(gzip.decompress(f.read(length)))
+
+
+def iter_archived_activities(conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    ids = [row[0] for row in conn.execute("SELECT activity_id FROM archive_index ORDER BY activity_id").fetchall()]
+    for activity_id in ids:
+        yield load_archived_activity(activity_id, conn)
+    if own_conn:
+        conn.close()
+
+
+def archive_json_dump(filename):
+    # One-off migration for the old full-history dumps (data/strava_YYYY-MM-DD.json)
+    activities = load_json(filename)
+    conn = connect()
+    archived = {row[0] for row in conn.execute("SELECT activity_id FROM archive_index")}
+    new = [a for a in activities if a["id"] not in archived]
+    archive_activities(new, conn)
+    conn.commit()
+    conn.close()
+    print(f"Archived {len(new)} activities from {filename} ({len(activities) - len(new)} already archived).")
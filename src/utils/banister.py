@@ -0,0 +1,192 @@
+from datetime import date, datetime
+import numpy as np
+
+# Candidate time constants (days) searched when fitting the model
+TAU_FITNESS = np.arange(20, 61, 2)
+TAU_FATIGUE = np.arange(3, 21)
+
+DEFAULT_HR_RESERVE = 0.6  # assumed intensity for runs without heart rate
+MIN_OBSERVATIONS = 10
+
+# Relative load of one session, in units of the athlete's typical easy run
+WORKOUTS = {
+    "rest": 0.0,
+    "easy": 1.0,
+    "tempo": 1.6,
+    "intervals": 1.8,
+    "long": 2.2,
+}
+
+TEMPLATES = [
+    ["rest", "easy", "easy", "rest", "easy", "rest", "long"],
+    ["rest", "easy", "tempo", "rest", "easy", "easy", "long"],
+    ["rest", "intervals", "easy", "rest", "tempo", "easy", "long"],
+    ["easy", "intervals", "easy", "tempo", "rest", "easy", "long"],
+    ["rest", "easy", "rest", "easy", "rest", "easy", "rest"],
+]
+WEEK_FACTORS = np.array([0.6, 0.8, 1.0, 1.1, 1.2, 1.3])
+MAX_WEEKLY_RAMP = 1.15  # a week may carry at most 15% more load than the one before
+
+
+def trimp(moving_time: float, average_hr: float | None, max_hr: float, resting_hr: float) -> float:
+    # Banister TRIMP: minutes x HR reserve x exponential intensity weighting
+    if average_hr is None or max_hr <= resting_hr:
+        reserve = DEFAULT_HR_RESERVE
+    else:
+        reserve = min(max((average_hr - resting_hr) / (max_hr - resting_hr), 0.0), 1.0)
+    return moving_time / 60 * reserve * 0.64 * np.exp(1.92 * reserve)
+
+
+def performance(run: dict, max_hr: float, resting_hr: float) -> float | None:
+    # Speed bought per unit of HR reserve; only runs with HR count
+    if run.get("average_hr") is None or not run.get("average_speed") or max_hr <= resting_hr:
+        return None
+    reserve = (run["average_hr"] - resting_hr) / (max_hr - resting_hr)
+    if reserve <= 0:
+        return None
+    return run["average_speed"] * 3.6 / reserve
+
+
+def daily_series(runs: list[dict], max_hr: float, resting_hr: float, end: date = None):
+    starts = [datetime.fromisoformat(r["start_date"]).date() for r in runs]
+    first = min(starts)
+    end = end or date.today()
+    days = (end - first).days + 1
+
+    load = np.zeros(days)
+    perf_sum = np.zeros(days)
+    perf_count = np.zeros(days)
+    for run, day in zip(runs, starts):
+        i = (day - first).days
+        if i >= days:
+            continue
+        load[i] += trimp(run["moving_time"], run.get("average_hr"), max_hr, resting_hr)
+        p = performance(run, max_hr, resting_hr)
+        if p is not None:
+            perf_sum[i] += p
+            perf_count[i] += 1
+
+    with np.errstate(invalid="ignore"):
+        perf = np.where(perf_count > 0, perf_sum / perf_count, np.nan)
+    return first, load, perf
+
+
+def responses(load: np.ndarray, taus: np.ndarray) -> np.ndarray:
+    # g[:, t] = sum over s < t of load[s] * exp(-(t - s) / tau), one row per tau.
+    # Row t + 1 only needs row t, so this is one pass over the days.
+    decay = np.exp(-1.0 / taus)
+    g = np.zeros((len(taus), len(load) + 1))
+    for t in range(len(load)):
+        g[:, t + 1] = decay * (g[:, t] + load[t])
+    return g
+
+
+def fit_model(load: np.ndarray, perf: np.ndarray) -> dict:
+    observed = np.flatnonzero(np.isfinite(perf))
+    if len(observed) < MIN_OBSERVATIONS:
+        raise ValueError(f"Need at least {MIN_OBSERVATIONS} runs with heart rate to fit the model, found {len(observed)}")
+
+    fitness = responses(load, TAU_FITNESS)[:, observed]
+    fatigue = responses(load, TAU_FATIGUE)[:, observed]
+    y = perf[observed]
+
+    # p0, k1 and k2 are linear once the taus are fixed, so every (tau1, tau2)
+    # pair is one small least-squares solve, batched over the whole grid.
+    n1, n2, n = len(TAU_FITNESS), len(TAU_FATIGUE), len(observed)
+    design = np.stack([
+        np.ones((n1, n2, n)),
+        np.broadcast_to(fitness[:, None, :], (n1, n2, n)),
+        -np.broadcast_to(fatigue[None, :, :], (n1, n2, n)),
+    ], axis=-1)
+    lhs = np.einsum("abni,abnj->abij", design, design)
+    rhs = np.einsum("abni,n->abi", design, y)
+    params = (np.linalg.pinv(lhs) @ rhs[..., None])[..., 0]
+    sse = ((design @ params[..., None])[..., 0] - y) ** 2
+    sse = sse.sum(axis=-1)
+
+    # Prefer fits where fitness helps and fatigue hurts
+    plausible = (params[..., 1] > 0) & (params[..., 2] > 0)
+    a, b = np.unravel_index(np.argmin(np.where(plausible, sse, np.inf) if plausible.any() else sse), sse.shape)
+
+    return {
+        "p0": float(params[a, b, 0]),
+        "k1": float(params[a, b, 1]),
+        "k2": float(params[a, b, 2]),
+        "tau1": float(TAU_FITNESS[a]),
+        "tau2": float(TAU_FATIGUE[b]),
+        "rmse": float(np.sqrt(sse[a, b] / n)),
+    }
+
+
+def plan_kernel(model: dict, days: int) -> np.ndarray:
+    # Effect of one unit of load on plan day d on performance the day after
+    # the plan ends (the target day): fitness gain minus fatigue cost.
+    lag = days - np.arange(days)
+    return model["k1"] * np.exp(-lag / model["tau1"]) - model["k2"] * np.exp(-lag / model["tau2"])
+
+
+def predict(model: dict, load: np.ndarray, plans: np.ndarray) -> np.ndarray:
+    # plans: (n_plans, days) daily loads from tomorrow through the day before
+    # the target; the prediction is for the target day. The model is linear
+    # in load, so ranking any number of plans is one mat-vec.
+    days = plans.shape[1]
+    fitness = responses(load, np.array([model["tau1"]]))[0, -1]
+    fatigue = responses(load, np.array([model["tau2"]]))[0, -1]
+    base = (model["p0"]
+            + model["k1"] * fitness * np.exp(-days / model["tau1"])
+            - model["k2"] * fatigue * np.exp(-days / model["tau2"]))
+    return base + plans @ plan_kernel(model, days)
+
+
+def generate_plans(n_plans: int, weeks: int, unit_load: float, recent_weekly_load: float, rng=None):
+    rng = rng or np.random.default_rng()
+    template_loads = np.array([[WORKOUTS[w] for w in t] for t in TEMPLATES])
+
+    templates = rng.integers(len(TEMPLATES), size=(n_plans, weeks))
+    factors = WEEK_FACTORS[rng.integers(len(WEEK_FACTORS), size=(n_plans, weeks))]
+    loads = template_loads[templates] * factors[..., None] * unit_load
+
+    # Scale back any week that ramps faster than MAX_WEEKLY_RAMP; a loop over
+    # weeks, vectorised over plans
+    previous = np.full(n_plans, max(recent_weekly_load, unit_load))
+    for w in range(weeks):
+        weekly = loads[:, w].sum(axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.where(weekly > 0, np.minimum(1.0, MAX_WEEKLY_RAMP * previous / weekly), 1.0)
+        loads[:, w] *= scale[:, None]
+        factors[:, w] *= scale
+        previous = np.maximum(loads[:, w].sum(axis=-1), unit_load)
+
+    return templates, factors, loads.reshape(n_plans, weeks * 7)
+
+
+def recommend(model: dict, load: np.ndarray, days: int, n_plans: int = 5000, top: int = 5, rng=None) -> list[dict]:
+    # days: days until the target. Training stops the day before; race-day
+    # load would only show up in performance the day after.
+    days -= 1
+    weeks = -(-days // 7)
+    recent = load[-56:]
+    unit_load = float(np.median(recent[recent > 0])) if (recent > 0).any() else trimp(30 * 60, None, 1, 0)
+    recent_weekly_load = float(recent.sum() / (len(recent) / 7))
+
+    templates, factors, plans = generate_plans(n_plans, weeks, unit_load, recent_weekly_load, rng)
+    scores = predict(model, load, plans[:, :days])
+
+    # The last week is usually partial: only report the days that were scored.
+    # Different draws can give the same plan, so keep only the first of each.
+    recommendations = []
+    seen = set()
+    for i in np.argsort(scores)[::-1]:
+        weeks_detail = [
+            {"factor": float(factors[i, w]), "workouts": TEMPLATES[templates[i, w]][:days - w * 7],
+             "load": float(plans[i, w * 7:min((w + 1) * 7, days)].sum())}
+            for w in range(weeks)
+        ]
+        key = tuple((tuple(week["workouts"]), round(week["factor"], 6)) for week in weeks_detail)
+        if key in seen:
+            continue
+        seen.add(key)
+        recommendations.append({"predicted_performance": float(scores[i]), "weeks": weeks_detail})
+        if len(recommendations) == top:
+            break
+    return recommendations
@@ -0,0 +1,194 @@
+import json
+import numpy as np
+from utils.strava_db import connect
+from utils.duplicates import DUPLICATE_IDS
+
+MIN_DURATION = 5  # shortest window on the mean-maximal curves (s)
+
+# (up to seconds, step seconds): the curves are sampled densely where they
+# change fastest and coarsely on the long, flat tail.
+DURATION_STEPS = [
+    (120, 1),
+    (600, 5),
+    (1800, 15),
+    (3600, 30),
+]
+TAIL_STEP = 60
+
+STANDARD_DISTANCES = {
+    "1k": 1000.0,
+    "5k": 5000.0,
+    "10k": 10000.0,
+    "half": 21097.5,
+}
+
+# curve -> True if a higher value is a better effort
+CURVES = {
+    "pace": True,       # duration (s) -> best mean speed (m/s)
+    "hr": True,         # duration (s) -> max mean heart rate (bpm)
+    "distance": False,  # distance (m) -> fastest time (s)
+}
+
+
+def resample_1hz(streams: dict) -> dict:
+    # Strava drops samples while paused, so put everything on a 1 s grid
+    # first; window length in samples then equals window length in seconds.
+    time = np.asarray(streams["time"], dtype=np.float64)
+    grid = np.arange(time[0], time[-1] + 1)
+
+    resampled = {"time": grid}
+    for key in ("distance", "heartrate"):
+        if streams.get(key):
+            resampled[key] = np.interp(grid, time, np.asarray(streams[key], dtype=np.float64))
+    return resampled
+
+
+def duration_grid(length: int) -> np.ndarray:
+    if length < MIN_DURATION:
+        return np.array([], dtype=np.int64)
+
+    pieces = []
+    start = MIN_DURATION
+    for limit, step in DURATION_STEPS + [(length, TAIL_STEP)]:
+        first = -(-start // step) * step  # keep each piece on round multiples of its step
+        pieces.append(np.arange(first, min(limit, length) + 1, step))
+        start = limit + 1
+
+    grid = np.unique(np.concatenate(pieces + [[length]])).astype(np.int64)
+    return grid[grid <= length]
+
+
+def window_maxima(cumulative: np.ndarray, durations: np.ndarray) -> np.ndarray:
+    # cumulative[i] is the running total up to sample i, so every window sum
+    # of width d is one vectorised subtraction: O(n) per duration.
+    return np.array([(cumulative[d:] - cumulative[:-d]).max() / d for d in durations])
+
+
+def fastest_distances(distance: np.ndarray, targets: dict) -> dict:
+    # For every start i, the first end j with distance[j] - distance[i] >= D.
+    # distance is monotonic and so are the needles, so searchsorted walks both
+    # arrays like a two-pointer sweep.
+    starts = np.arange(len(distance))
+    best = {}
+    for name, meters in targets.items():
+        if distance[-1] - distance[0] < meters:
+            continue
+        ends = np.searchsorted(distance, distance + meters, side="left")
+        valid = ends < len(distance)
+        best[name] = float((ends[valid] - starts[valid]).min())
+    return best
+
+
+def compute_best_efforts(streams: dict) -> dict:
+    if not streams.get("time"):
+        return {}
+
+    samples = resample_1hz(streams)
+    durations = duration_grid(len(samples["time"]) - 1)
+    if len(durations) == 0:
+        return {}
+
+    curves = {}
+    if "distance" in samples:
+        distance = np.maximum.accumulate(samples["distance"])
+        curves["pace"] = dict(zip(durations.tolist(), window_maxima(distance, durations).tolist()))
+        curves["distance"] = {
+            STANDARD_DISTANCES[name]: seconds
+            for name, seconds in fastest_distances(distance, STANDARD_DISTANCES).items()
+        }
+
+    if "heartrate" in samples:
+        hr_sum = np.concatenate(([0.0], np.cumsum(samples["heartrate"])))
+        # hr_sum has one more entry than there are samples
+        hr_durations = durations[durations < len(hr_sum)]
+        curves["hr"] = dict(zip(hr_durations.tolist(), window_maxima(hr_sum, hr_durations).tolist()))
+
+    return {curve: points for curve, points in curves.items() if points}
+
+
+def save_best_efforts(activity_id: int, curves: dict, conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    holds_bests = conn.execute("SELECT 1 FROM best_effort_envelope WHERE activity_id = ? LIMIT 1", (activity_id,)).fetchone()
+    duplicate = conn.execute(f"SELECT 1 FROM ({DUPLICATE_IDS}) WHERE activity_id = ?", (activity_id,)).fetchone()
+    conn.execute("DELETE FROM best_efforts WHERE activity_id = ?", (activity_id,))
+    conn.executemany(
+        "INSERT INTO best_efforts (activity_id, curve, data) VALUES (?, ?, ?)",
+        [(activity_id, curve, json.dumps(list(points.items()))) for curve, points in curves.items()]
+    )
+    # The envelope can only be raised in place. If this activity's old
+    # curves hold all-time bests, those may have to come down again.
+    if holds_bests:
+        rebuild_envelope(conn)
+    elif not duplicate:
+        update_envelope(activity_id, curves, conn)
+    if own_conn:
+        conn.commit()
+        conn.close()
+
+
+def update_envelope(activity_id: int, curves: dict, conn):
+    # Only rows this activity beats are touched, so keeping the all-time
+    # envelope current costs one upsert per curve point.
+    for curve, points in curves.items():
+        better = ">" if CURVES[curve] else "<"
+        conn.executemany(f"""
+            INSERT INTO best_effort_envelope (curve, key, value, activity_id)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (curve, key) DO UPDATE SET
+                value = excluded.value,
+                activity_id = excluded.activity_id
+            WHERE excluded.value {better} best_effort_envelope.value
+        """, [(curve, key, value, activity_id) for key, value in points.items()])
+
+
+def load_best_efforts(activity_id: int, conn=None) -> dict:
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    rows = conn.execute("SELECT curve, data FROM best_efforts WHERE activity_id = ?", (activity_id,)).fetchall()
+    if own_conn:
+        conn.close()
+    return {curve: {key: value for key, value in json.loads(data)} for curve, data in rows}
+
+
+def load_envelope(curve: str, conn=None) -> list[tuple]:
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    rows = conn.execute(
+        "SELECT key, value, activity_id FROM best_effort_envelope WHERE curve = ? ORDER BY key",
+        (curve,)
+    ).fetchall()
+    if own_conn:
+        conn.close()
+    return rows
+
+
+def rebuild_envelope(conn=None):
+    # Full recompute from the stored curves, leaving out flagged duplicates
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    best = {}
+    rows = conn.execute(f"SELECT activity_id, curve, data FROM best_efforts WHERE activity_id NOT IN ({DUPLICATE_IDS})").fetchall()
+    for activity_id, curve, data in rows:
+        higher = CURVES[curve]
+        for key, value in json.loads(data):
+            current = best.get((curve, key))
+            if current is None or (value > current[0] if higher else value < current[0]):
+                best[(curve, key)] = (value, activity_id)
+
+    conn.execute("DELETE FROM best_effort_envelope")
+    conn.executemany(
+        "INSERT INTO best_effort_envelope (curve, key, value, activity_id) VALUES (?, ?, ?, ?)",
+        [(curve, key, value, activity_id) for (curve, key), (value, activity_id) in best.items()]
+    )
+    if own_conn:
+        conn.commit()
+        conn.close()
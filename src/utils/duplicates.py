@@ -0,0 +1,128 @@
+from datetime import datetime
+from utils.strava_db import connect
+
+MIN_OVERLAP = 0.5           # fraction of the shorter activity that must overlap
+MAX_ACTIVITY_SECONDS = 86400  # bounds the index range scan for overlaps
+
+# Rows in activity_intervals with duplicate_of set are copies of another
+# activity; every aggregate query filters them out with this clause.
+DUPLICATE_IDS = "SELECT activity_id FROM activity_intervals WHERE duplicate_of IS NOT NULL"
+NOT_DUPLICATE = f"id NOT IN ({DUPLICATE_IDS})"
+
+
+def _interval(start_date, elapsed_time) -> tuple[int, int]:
+    start = start_date if isinstance(start_date, datetime) else datetime.fromisoformat(start_date)
+    start_ts = int(start.timestamp())
+    return start_ts, start_ts + int(elapsed_time or 0)
+
+
+def _overlap_fraction(a: tuple[int, int], b: tuple[int, int]) -> float:
+    shorter = min(a[1] - a[0], b[1] - b[0])
+    if shorter <= 0:
+        return 1.0 if a[0] == b[0] else 0.0
+    return max(0, min(a[1], b[1]) - max(a[0], b[0])) / shorter
+
+
+def _rank(conn, ids: list[int]) -> list[int]:
+    # Keep the copy with heart rate, then the longer one, then the older ID
+    placeholders = ", ".join("?" for _ in ids)
+    rows = conn.execute(
+        f"SELECT id, average_hr IS NOT NULL, COALESCE(distance, 0) FROM activities WHERE id IN ({placeholders})",
+        ids
+    ).fetchall()
+    rows.sort(key=lambda r: (-r[1], -r[2], r[0]))
+    return [r[0] for r in rows]
+
+
+def _mark_cluster(conn, ids: list[int]):
+    ranked = _rank(conn, ids)
+    if not ranked:
+        return
+    primary = ranked[0]
+    conn.execute("UPDATE activity_intervals SET duplicate_of = NULL WHERE activity_id = ?", (primary,))
+    conn.executemany(
+        "UPDATE activity_intervals SET duplicate_of = ? WHERE activity_id = ? OR duplicate_of = ?",
+        [(primary, other, other) for other in ranked[1:]]
+    )
+
+
+def _count_flagged(conn) -> int:
+    return conn.execute("SELECT COUNT(*) FROM activity_intervals WHERE duplicate_of IS NOT NULL").fetchone()[0]
+
+
+def find_overlaps(conn, start_ts: int, end_ts: int, exclude_id: int = None) -> list[int]:
+    # Range scan on idx_activity_intervals_start: O(log n) to find the first
+    # candidate, then only activities starting within a day before.
+    rows = conn.execute("""
+        SELECT activity_id, start_ts, end_ts FROM activity_intervals
+        WHERE start_ts > ? AND start_ts <= ? AND activity_id != ?
+    """, (start_ts - MAX_ACTIVITY_SECONDS, end_ts, -1 if exclude_id is None else exclude_id)).fetchall()
+    return [a for a, s, e in rows if _overlap_fraction((start_ts, end_ts), (s, e)) >= MIN_OVERLAP]
+
+
+def index_activities(parsed_activities: list[dict], conn=None) -> int:
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    # Returns how many activities became duplicates; a new copy can push an
+    # existing one out as primary, so count flags rather than overlaps
+    flagged_before = _count_flagged(conn)
+    for a in parsed_activities:
+        start_ts, end_ts = _interval(a["start_date"], a["elapsed_time"])
+        conn.execute(
+            "INSERT OR REPLACE INTO activity_intervals (activity_id, start_ts, end_ts, duplicate_of) VALUES (?, ?, ?, NULL)",
+            (a["id"], start_ts, end_ts)
+        )
+        overlaps = find_overlaps(conn, start_ts, end_ts, a["id"])
+        if overlaps:
+            # Pull in whatever the overlapping activities were already merged into
+            placeholders = ", ".join("?" for _ in overlaps)
+            primaries = conn.execute(
+                f"SELECT COALESCE(duplicate_of, activity_id) FROM activity_intervals WHERE activity_id IN ({placeholders})",
+                overlaps
+            ).fetchall()
+            _mark_cluster(conn, sorted({a["id"], *overlaps, *(p[0] for p in primaries)}))
+    flagged = _count_flagged(conn) - flagged_before
+
+    if own_conn:
+        conn.commit()
+        conn.close()
+    return flagged
+
+
+def deduplicate_history(conn=None) -> int:
+    # Bulk pass: rebuild the interval table, then one sweep in start order
+    # groups each activity with the cluster it overlaps. O(n log n) overall.
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    rows = conn.execute("SELECT id, start_date, elapsed_time FROM activities WHERE start_date IS NOT NULL").fetchall()
+    intervals = sorted((*_interval(start, elapsed), activity_id) for activity_id, start, elapsed in rows)
+
+    conn.execute("DELETE FROM activity_intervals")
+    conn.executemany(
+        "INSERT INTO activity_intervals (activity_id, start_ts, end_ts, duplicate_of) VALUES (?, ?, ?, NULL)",
+        [(activity_id, s, e) for s, e, activity_id in intervals]
+    )
+
+    clusters = []
+    anchor = None
+    for s, e, activity_id in intervals:
+        if anchor and _overlap_fraction(anchor, (s, e)) >= MIN_OVERLAP:
+            clusters[-1].append(activity_id)
+        else:
+            anchor = (s, e)
+            clusters.append([activity_id])
+
+    duplicates = 0
+    for cluster in clusters:
+        if len(cluster) > 1:
+            _mark_cluster(conn, cluster)
+            duplicates += len(cluster) - 1
+
+    if own_conn:
+        conn.commit()
+        conn.close()
+    return duplicates
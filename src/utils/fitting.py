@@ -0,0 +1,174 @@
+import numpy as np
+
+METHODS = ["ols", "theil_sen", "huber"]
+
+HUBER_K = 1.345       # 95% efficiency on clean normal data
+HUBER_ITERATIONS = 50
+THEIL_SEN_ITERATIONS = 64
+
+
+# Every fit takes x/y as a single series (n,) or a batch of series (m, n)
+# padded with NaN, and returns polyfit-style coefficients (highest power
+# first) with shape (degree + 1,) or (m, degree + 1), so results drop
+# straight into np.poly1d / np.polyval.
+
+
+def _as_batch(x, y, weights=None):
+    x = np.atleast_2d(np.asarray(x, dtype=np.float64))
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    w = np.ones_like(y) if weights is None else np.atleast_2d(np.asarray(weights, dtype=np.float64))
+
+    valid = np.isfinite(x) & np.isfinite(y) & np.isfinite(w) & (w > 0)
+    return np.where(valid, x, np.nan), np.where(valid, y, np.nan), np.where(valid, w, 0.0)
+
+
+def _polyval(coeffs, x):
+    # Horner's rule across the whole batch
+    result = np.zeros_like(x)
+    for c in coeffs.T:
+        result = result * x + c[:, None]
+    return result
+
+
+def _solve_wls(x, y, w, degree):
+    # Centre and scale x per series before building the normal equations,
+    # otherwise day numbers (~2e4) squared swamp the solve.
+    mu = np.nanmean(x, axis=1, keepdims=True)
+    scale = np.nanstd(x, axis=1, keepdims=True)
+    scale[scale == 0] = 1.0
+    xs = np.nan_to_num((x - mu) / scale)
+    ys = np.nan_to_num(y)
+
+    design = xs[..., None] ** np.arange(degree, -1, -1)
+    weighted = design * w[..., None]
+    lhs = np.einsum("mni,mnj->mij", weighted, design)
+    rhs = np.einsum("mni,mn->mi", weighted, ys)
+    scaled = (np.linalg.pinv(lhs) @ rhs[..., None])[..., 0]
+
+    # Compose p((x - mu) / scale) back into a polynomial in raw x
+    a, b = (-mu / scale)[:, 0], (1.0 / scale)[:, 0]
+    coeffs = np.zeros_like(scaled)
+    for c in scaled.T:
+        shifted = np.zeros_like(coeffs)
+        shifted[:, :-1] = coeffs[:, 1:] * b[:, None]
+        coeffs = coeffs * a[:, None] + shifted
+        coeffs[:, -1] += c
+    return coeffs
+
+
+def weighted_fit(x, y, degree=1, weights=None):
+    single = np.ndim(y) == 1
+    x, y, w = _as_batch(x, y, weights)
+    coeffs = _solve_wls(x, y, w, degree)
+    return coeffs[0] if single else coeffs
+
+
+def huber_fit(x, y, degree=1, weights=None, k=HUBER_K, iterations=HUBER_ITERATIONS):
+    single = np.ndim(y) == 1
+    x, y, base = _as_batch(x, y, weights)
+
+    w = base
+    coeffs = _solve_wls(x, y, w, degree)
+    for _ in range(iterations):
+        residuals = y - _polyval(coeffs, x)
+        mad = np.nanmedian(np.abs(residuals - np.nanmedian(residuals, axis=1, keepdims=True)), axis=1, keepdims=True)
+        threshold = k * 1.4826 * mad
+        threshold[threshold == 0] = np.inf
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            huber = np.where(np.abs(residuals) <= threshold, 1.0, threshold / np.abs(residuals))
+        new_w = base * np.nan_to_num(huber)
+
+        if np.allclose(new_w, w):
+            break
+        w = new_w
+        coeffs = _solve_wls(x, y, w, degree)
+
+    return coeffs[0] if single else coeffs
+
+
+def _count_inversions(values):
+    # Bottom-up merge count over each row. Both halves of every block are
+    # already sorted from the previous level, so the stable (tim)sort only
+    # has two runs to merge: O(n) per level, O(n log n) overall.
+    m, n = values.shape
+    counts = np.zeros(m, dtype=np.int64)
+    width = 1
+    while width < n:
+        blocks = values.reshape(m, n // (2 * width), 2 * width)
+        order = np.argsort(blocks, axis=-1, kind="stable")
+        position = np.empty_like(order)
+        np.put_along_axis(position, order, np.arange(2 * width), axis=-1)
+
+        # right-half element q lands at position p: p - q left elements are
+        # <= it, everything else in the left half is an inversion
+        left_before = position[..., width:] - np.arange(width)
+        counts += (width - left_before).sum(axis=(1, 2))
+
+        values = np.take_along_axis(blocks, order, axis=-1).reshape(m, n)
+        width *= 2
+    return counts
+
+
+def theil_sen_fit(x, y, iterations=THEIL_SEN_ITERATIONS):
+    # Median pairwise slope without materialising the O(n^2) pairs: with
+    # points sorted by x, slope(i, j) < t exactly when y - t*x inverts
+    # between i and j, so each bisection step on t is one inversion count.
+    single = np.ndim(y) == 1
+    x, y, _ = _as_batch(x, y)
+    valid = np.isfinite(y)
+
+    order = np.lexsort((np.where(valid, y, np.inf), np.where(valid, x, np.inf)), axis=-1)
+    x = np.take_along_axis(x, order, axis=-1)
+    y = np.take_along_axis(y, order, axis=-1)
+    valid = np.take_along_axis(valid, order, axis=-1)
+
+    # Pad to a power of two; padding and missing points sit at +inf so they
+    # never form an inversion. Pairs sharing an x are sorted by y, so they
+    # never invert either and are left out of the total.
+    m, n = y.shape
+    size = 1 << max(int(np.ceil(np.log2(max(n, 2)))), 1)
+    x = np.pad(x, ((0, 0), (0, size - n)), constant_values=np.nan)
+    y = np.pad(y, ((0, 0), (0, size - n)), constant_values=np.nan)
+    valid = np.pad(valid, ((0, 0), (0, size - n)), constant_values=False)
+
+    index = np.arange(size)
+    new_run = np.ones_like(valid)
+    new_run[:, 1:] = x[:, 1:] != x[:, :-1]
+    run_start = np.maximum.accumulate(np.where(new_run, index, 0), axis=1)
+    tied_pairs = np.where(valid, index - run_start, 0).sum(axis=1)
+    n_valid = valid.sum(axis=1)
+    target = (n_valid * (n_valid - 1) // 2 - tied_pairs) / 2
+
+    with np.errstate(invalid="ignore"):
+        steps = np.where(valid[:, 1:] & valid[:, :-1], np.diff(x, axis=1), np.nan)
+        steps[steps <= 0] = np.nan
+    min_step = np.nan_to_num(np.nanmin(np.where(np.isnan(steps), np.inf, steps), axis=1), posinf=1.0)
+    y_range = np.nan_to_num(np.nanmax(y, axis=1) - np.nanmin(y, axis=1))
+    hi = y_range / min_step + 1.0
+    lo = -hi
+
+    for _ in range(iterations):
+        mid = (lo + hi) / 2
+        residuals = np.where(valid, y - mid[:, None] * x, np.inf)
+        below = _count_inversions(residuals) < target
+        lo = np.where(below, mid, lo)
+        hi = np.where(below, hi, mid)
+
+    slope = (lo + hi) / 2
+    intercept = np.nanmedian(np.where(valid, y - slope[:, None] * x, np.nan), axis=1)
+    coeffs = np.stack([slope, intercept], axis=1)
+    return coeffs[0] if single else coeffs
+
+
+def fit_trend(x, y, degree=1, method="ols", weights=None):
+    if method == "ols":
+        return weighted_fit(x, y, degree, weights)
+    elif method == "huber":
+        return huber_fit(x, y, degree, weights)
+    elif method == "theil_sen":
+        if degree != 1:
+            raise ValueError("Theil-Sen only fits straight lines (degree 1)")
+        return theil_sen_fit(x, y)  # rank based, so weights do not apply
+    else:
+        raise ValueError(f"Invalid fit method: {method}")
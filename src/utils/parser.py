@@ -17,6 +17,7 @@ def parse_activity(activity):
             'average_speed': activity.get('average_speed'),
             'max_speed': activity.get('max_speed'),
             'calories': activity.get('calories', None),
+            'summary_polyline': (activity.get('map') or {}).get('summary_polyline'),
             'vo2_max': calculate_vo2_max(
                 avg_speed=activity.get('average_speed'),
                 hr_max=activity.get('max_heartrate'),
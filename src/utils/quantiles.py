@@ -0,0 +1,243 @@
+import json
+import random
+from datetime import datetime
+from utils.strava_db import connect
+from utils.duplicates import NOT_DUPLICATE
+
+SKETCH_K = 200  # accuracy/size trade-off: rank error ~1.7 / K
+PERCENTILES = [10, 50, 90]
+ALL_TIME = "all"
+# activities has no type column, so as in load_runs_from_db every stored
+# activity over 1 km counts as a run
+SKETCH_FILTER = f"distance > 1000 AND {NOT_DUPLICATE}"
+
+
+class KLLSketch:
+    # KLL quantile sketch. Level i holds items that each stand for 2**i
+    # observations; a full level is sorted and every other item is promoted,
+    # so memory stays O(K) however many runs are added, and two sketches
+    # merge by concatenating their levels.
+
+    def __init__(self, k: int = SKETCH_K, n: int = 0, levels: list[list[float]] = None):
+        self.k = k
+        self.n = n
+        self.levels = levels or [[]]
+        self._rng = random.Random()
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(int(self.k * (2 / 3) ** depth), 2)
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) >= self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+                items = sorted(self.levels[level])
+                leftover = [items.pop()] if len(items) % 2 else []
+                self.levels[level + 1].extend(items[self._rng.getrandbits(1)::2])
+                self.levels[level] = leftover
+                level = 0  # capacities shift when a level is added
+            else:
+                level += 1
+
+    def update(self, value: float):
+        self.levels[0].append(float(value))
+        self.n += 1
+        self._compress()
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantile(self, q: float) -> float | None:
+        weighted = sorted((v, 1 << level) for level, items in enumerate(self.levels) for v in items)
+        if not weighted:
+            return None
+        total = sum(w for _, w in weighted)
+        running = 0
+        for value, weight in weighted:
+            running += weight
+            if running >= q * total:
+                return value
+        return weighted[-1][0]
+
+    def to_json(self) -> str:
+        return json.dumps({"k": self.k, "n": self.n, "levels": self.levels})
+
+    @classmethod
+    def from_json(cls, data: str) -> "KLLSketch":
+        d = json.loads(data)
+        return cls(d["k"], d["n"], d["levels"])
+
+
+def run_metrics(run: dict) -> dict:
+    metrics = {"distance": run["distance"]}
+    if run["distance"] > 0:
+        metrics["pace_min_per_km"] = run["moving_time"] / (run["distance"] / 1000)
+        metrics["elevation_gain_per_km"] = run["total_elevation_gain"] / (run["distance"] / 1000)
+    if run.get("average_hr") is not None:
+        metrics["heart_rate"] = run["average_hr"]
+    return metrics
+
+
+def month_scope(start_date) -> str:
+    start = start_date if isinstance(start_date, datetime) else datetime.fromisoformat(start_date)
+    return start.strftime("%Y-%m")
+
+
+def build_sketches(runs: list[dict]) -> dict:
+    sketches = {}
+    for run in runs:
+        for metric, value in run_metrics(run).items():
+            sketches.setdefault(metric, KLLSketch()).update(value)
+    return sketches
+
+
+def sketch_percentiles(sketches: dict) -> dict:
+    return {
+        f"p{p}_{metric}": sketch.quantile(p / 100)
+        for metric, sketch in sketches.items()
+        for p in PERCENTILES
+    }
+
+
+def _save(conn, scope: str, sketches: dict):
+    conn.executemany(
+        "INSERT OR REPLACE INTO quantile_sketches (scope, metric, data) VALUES (?, ?, ?)",
+        [(scope, metric, sketch.to_json()) for metric, sketch in sketches.items()]
+    )
+
+
+def _load_runs(conn, where: str = "1", params=()) -> list[dict]:
+    # Incremental updates and rebuilds both read runs through SKETCH_FILTER,
+    # so the two paths can't disagree on what counts
+    rows = conn.execute(f"""
+        SELECT id, distance, moving_time, total_elevation_gain, average_hr, start_date
+        FROM activities
+        WHERE {SKETCH_FILTER} AND {where}
+    """, params).fetchall()
+    return [
+        {"id": r[0], "distance": r[1], "moving_time": r[2], "total_elevation_gain": r[3], "average_hr": r[4], "start_date": r[5]}
+        for r in rows
+    ]
+
+
+def _load(conn, scopes: list[str]) -> dict:
+    rows = conn.execute(
+        f"SELECT metric, data FROM quantile_sketches WHERE scope IN ({', '.join('?' for _ in scopes)})",
+        scopes
+    ).fetchall()
+    sketches = {}
+    for metric, data in rows:
+        sketch = KLLSketch.from_json(data)
+        sketches[metric] = sketches[metric].merge(sketch) if metric in sketches else sketch
+    return sketches
+
+
+def _rebuild_scope(conn, scope: str):
+    if scope == ALL_TIME:
+        runs = _load_runs(conn)
+    else:
+        runs = _load_runs(conn, "substr(start_date, 1, 7) = ?", (scope,))
+    conn.execute("DELETE FROM quantile_sketches WHERE scope = ?", (scope,))
+    _save(conn, scope, build_sketches(runs))
+
+
+def _is_stale(conn) -> bool:
+    # Every run has a distance, so the all-time distance sketch's n is the
+    # number of runs folded in. Missing (databases from before the sketches
+    # existed) or off by any amount means it has to be rebuilt.
+    row = conn.execute(
+        "SELECT data FROM quantile_sketches WHERE scope = ? AND metric = 'distance'", (ALL_TIME,)
+    ).fetchone()
+    folded = KLLSketch.from_json(row[0]).n if row else 0
+    return folded != conn.execute(f"SELECT COUNT(*) FROM activities WHERE {SKETCH_FILTER}").fetchone()[0]
+
+
+def load_sketches(scopes: list[str] = None, conn=None) -> dict:
+    # Sketches for several scopes (e.g. a run of months) merge into one
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    scopes = scopes or [ALL_TIME]
+    if ALL_TIME in scopes and _is_stale(conn):
+        rebuild_sketches(conn)
+    sketches = _load(conn, scopes)
+    if own_conn:
+        conn.commit()
+        conn.close()
+    return sketches
+
+
+def update_sketches(activity_ids, conn=None, replaced: bool = False):
+    # Fold newly inserted runs into the all-time and per-month sketches.
+    # A sketch can't forget a value, so scopes holding a replaced run, or a
+    # copy that a new run just took over from as primary, are rebuilt.
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    ids = list(activity_ids)
+    placeholders = ", ".join("?" for _ in ids)
+    rebuild = set()
+    if ids and replaced:
+        rows = conn.execute(f"SELECT start_date FROM activities WHERE id IN ({placeholders})", ids).fetchall()
+        rebuild = {ALL_TIME} | {month_scope(r[0]) for r in rows}
+    runs = _load_runs(conn, f"id IN ({placeholders})", ids) if ids and not replaced else []
+
+    by_scope = {}
+    for run in runs:
+        scopes = {ALL_TIME, month_scope(run["start_date"])}
+        demoted = conn.execute("""
+            SELECT a.start_date FROM activity_intervals i JOIN activities a ON a.id = i.activity_id
+            WHERE i.duplicate_of = ?
+        """, (run["id"],)).fetchall()
+        if demoted:
+            rebuild |= scopes | {month_scope(r[0]) for r in demoted}
+        for scope in scopes:
+            by_scope.setdefault(scope, []).append(run)
+
+    for scope, scope_runs in by_scope.items():
+        if scope in rebuild:
+            continue
+        sketches = _load(conn, [scope])
+        for metric, sketch in build_sketches(scope_runs).items():
+            sketches[metric] = sketches[metric].merge(sketch) if metric in sketches else sketch
+        _save(conn, scope, sketches)
+    for scope in rebuild:
+        _rebuild_scope(conn, scope)
+
+    # Catches the first import after upgrading, when there is no all-time
+    # sketch yet to fold into
+    if _is_stale(conn):
+        rebuild_sketches(conn)
+    if own_conn:
+        conn.commit()
+        conn.close()
+
+
+def rebuild_sketches(conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    runs = _load_runs(conn)
+    conn.execute("DELETE FROM quantile_sketches")
+    _save(conn, ALL_TIME, build_sketches(runs))
+    by_month = {}
+    for run in runs:
+        by_month.setdefault(month_scope(run["start_date"]), []).append(run)
+    for scope, month_runs in by_month.items():
+        _save(conn, scope, build_sketches(month_runs))
+
+    if own_conn:
+        conn.commit()
+        conn.close()
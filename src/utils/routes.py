@@ -0,0 +1,144 @@
+import json
+import numpy as np
+from utils.strava_db import connect
+
+GRID_DEG = 0.005          # ~500 m grid cells for the start-point index
+SIGNATURE_POINTS = 16     # points the route shape is resampled to
+MAX_SHAPE_DISTANCE = 150  # mean distance (m) between signature points to call it the same route
+MAX_LENGTH_RATIO = 1.15
+
+METERS_PER_DEG_LAT = 110540
+METERS_PER_DEG_LNG = 111320
+
+
+def decode_polyline(polyline: str) -> np.ndarray:
+    # Google encoded polyline format, as used by map.summary_polyline
+    coords = []
+    index = lat = lng = 0
+    while index < len(polyline):
+        for axis in range(2):
+            shift = result = 0
+            while True:
+                b = ord(polyline[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            delta = ~(result >> 1) if result & 1 else result >> 1
+            if axis == 0:
+                lat += delta
+            else:
+                lng += delta
+        coords.append((lat / 1e5, lng / 1e5))
+    return np.array(coords, dtype=np.float64).reshape(-1, 2)
+
+
+def _to_meters(points: np.ndarray, origin_lat: float) -> np.ndarray:
+    scale = np.array([METERS_PER_DEG_LAT, METERS_PER_DEG_LNG * np.cos(np.radians(origin_lat))])
+    return points * scale
+
+
+def shape_signature(points: np.ndarray) -> tuple[np.ndarray, float]:
+    # Resample the track to SIGNATURE_POINTS points evenly spaced by distance
+    meters = _to_meters(points, points[0, 0])
+    along = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(meters, axis=0).T))))
+    targets = np.linspace(0, along[-1], SIGNATURE_POINTS)
+    signature = np.column_stack([np.interp(targets, along, points[:, 0]), np.interp(targets, along, points[:, 1])])
+    return signature, float(along[-1])
+
+
+def grid_cell(lat: float, lng: float) -> tuple[int, int]:
+    return int(np.floor(lat / GRID_DEG)), int(np.floor(lng / GRID_DEG))
+
+
+def _neighbour_cells(cell: tuple[int, int]) -> list[str]:
+    return [f"{cell[0] + di}:{cell[1] + dj}" for di in (-1, 0, 1) for dj in (-1, 0, 1)]
+
+
+def match_route(conn, signature: np.ndarray, length: float) -> int | None:
+    # Only routes starting in the 3x3 block of grid cells around this start
+    # are candidates, so matching never scans the whole routes table.
+    cells = _neighbour_cells(grid_cell(*signature[0]))
+    rows = conn.execute(
+        f"SELECT route_id, signature, length FROM routes WHERE start_cell IN ({', '.join('?' for _ in cells)})",
+        cells
+    ).fetchall()
+    if not rows:
+        return None
+
+    lengths = np.array([r[2] for r in rows])
+    ratio = np.maximum(lengths, length) / np.maximum(np.minimum(lengths, length), 1.0)
+    candidates = np.array([json.loads(r[1]) for r in rows])
+    gaps = np.hypot(*(_to_meters(candidates - signature, signature[0, 0])).transpose(2, 0, 1)).mean(axis=1)
+
+    score = np.where(ratio <= MAX_LENGTH_RATIO, gaps, np.inf)
+    best = int(np.argmin(score))
+    return rows[best][0] if score[best] <= MAX_SHAPE_DISTANCE else None
+
+
+def assign_route(conn, activity_id: int, polyline: str | None) -> int | None:
+    points = decode_polyline(polyline) if polyline else np.empty((0, 2))
+    route_id = None
+    if len(points) >= 2:
+        signature, length = shape_signature(points)
+        route_id = match_route(conn, signature, length)
+        if route_id is None:
+            cell = grid_cell(*signature[0])
+            route_id = conn.execute(
+                "INSERT INTO routes (start_cell, signature, length) VALUES (?, ?, ?)",
+                (f"{cell[0]}:{cell[1]}", json.dumps(signature.tolist()), length)
+            ).lastrowid
+
+    conn.execute(
+        "INSERT OR REPLACE INTO activity_routes (activity_id, polyline, route_id) VALUES (?, ?, ?)",
+        (activity_id, polyline, route_id)
+    )
+    return route_id
+
+
+def save_routes(parsed_activities: list[dict], conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    for a in parsed_activities:
+        assign_route(conn, a["id"], a.get("summary_polyline"))
+    if own_conn:
+        conn.commit()
+        conn.close()
+
+
+def cluster_routes(polylines: dict[int, str] = None, conn=None) -> int:
+    # Bulk pass: reassign every stored polyline (plus any new ones passed in),
+    # oldest activity first. Existing routes are matched before new ones are
+    # created, so route IDs stay stable across runs (plot_daily_averages.py
+    # --route takes them); routes nothing matches any more are dropped.
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    stored = dict(conn.execute("SELECT activity_id, polyline FROM activity_routes").fetchall())
+    stored.update(polylines or {})
+    order = dict(conn.execute("SELECT id, start_date FROM activities").fetchall())
+
+    for activity_id in sorted(stored, key=lambda i: (order.get(i) or "", i)):
+        assign_route(conn, activity_id, stored[activity_id])
+    conn.execute("DELETE FROM routes WHERE route_id NOT IN (SELECT route_id FROM activity_routes WHERE route_id IS NOT NULL)")
+
+    count = conn.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+    if own_conn:
+        conn.commit()
+        conn.close()
+    return count
+
+
+def get_route_id(activity_id: int, conn=None) -> int | None:
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    row = conn.execute("SELECT route_id FROM activity_routes WHERE activity_id = ?", (activity_id,)).fetchone()
+    if own_conn:
+        conn.close()
+    return row[0] if row else None
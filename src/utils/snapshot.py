@@ -0,0 +1,114 @@
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+from utils.strava_db import DB_PATH, connect
+
+SNAPSHOT_DIR = DB_PATH.parent / "snapshot"
+FORMATS = {"arrow": "ipc", "parquet": "parquet"}
+STREAM_TYPES = ["time", "distance", "heartrate", "velocity_smooth", "altitude"]
+
+
+def _partition_columns(table: pa.Table, start_dates) -> pa.Table:
+    dates = pd.to_datetime(pd.Series(start_dates), utc=True)
+    table = table.append_column("year", pa.array(dates.dt.year.astype("int16")))
+    return table.append_column("month", pa.array(dates.dt.month.astype("int8")))
+
+
+def _write(table: pa.Table, name: str, out_dir, fmt: str):
+    ds.write_dataset(
+        table,
+        out_dir / name,
+        format=FORMATS[fmt],
+        partitioning=["year", "month"],
+        partitioning_flavor="hive",
+        existing_data_behavior="delete_matching",
+    )
+
+
+def activities_table(conn) -> tuple[pa.Table, pd.Series]:
+    df = pd.read_sql_query("""
+        SELECT
+            a.*,
+            a.moving_time / (NULLIF(a.distance, 0) / 1000.0) AS pace_s_per_km,
+            a.average_speed * 3.6 AS speed_kmh,
+            a.total_elevation_gain / (NULLIF(a.distance, 0) / 1000.0) AS elevation_gain_per_km,
+            r.route_id,
+            i.duplicate_of,
+            z.hr_z1, z.hr_z2, z.hr_z3, z.hr_z4, z.hr_z5,
+            z.pace_z1, z.pace_z2, z.pace_z3, z.pace_z4, z.pace_z5, z.pace_z6
+        FROM activities a
+        LEFT JOIN activity_routes r ON r.activity_id = a.id
+        LEFT JOIN activity_intervals i ON i.activity_id = a.id
+        LEFT JOIN activity_zones z ON z.activity_id = a.id
+    """, conn)
+    start_dates = df["start_date"]
+    df["start_date"] = pd.to_datetime(df["start_date"], utc=True)
+    return pa.Table.from_pandas(df, preserve_index=False), start_dates
+
+
+def streams_table(conn) -> tuple[pa.Table, list]:
+    # One row per sample, one column per stream type (NaN where missing)
+    starts = dict(conn.execute("SELECT id, start_date FROM activities").fetchall())
+    columns = {t: [] for t in ["activity_id"] + STREAM_TYPES}
+    start_dates = []
+
+    rows = conn.execute("SELECT activity_id, type, data FROM streams ORDER BY activity_id").fetchall()
+    by_activity = {}
+    for activity_id, stream_type, data in rows:
+        by_activity.setdefault(activity_id, {})[stream_type] = json.loads(data)
+
+    for activity_id, streams in by_activity.items():
+        if activity_id not in starts or not streams.get("time"):
+            continue
+        n = len(streams["time"])
+        columns["activity_id"].append(np.full(n, activity_id, dtype=np.int64))
+        for t in STREAM_TYPES:
+            values = streams.get(t)
+            columns[t].append(np.asarray(values, dtype=np.float64) if values and len(values) == n else np.full(n, np.nan))
+        start_dates.extend([starts[activity_id]] * n)
+
+    if not start_dates:
+        return None, []
+    table = pa.table({name: np.concatenate(parts) for name, parts in columns.items()})
+    return table, start_dates
+
+
+def export_snapshot(out_dir=SNAPSHOT_DIR, fmt: str = "arrow", conn=None) -> dict:
+    if fmt not in FORMATS:
+        raise ValueError(f"Invalid snapshot format: {fmt}")
+
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    counts = {}
+    activities, start_dates = activities_table(conn)
+    _write(_partition_columns(activities, start_dates), "activities", out_dir, fmt)
+    counts["activities"] = activities.num_rows
+
+    streams, start_dates = streams_table(conn)
+    if streams is not None:
+        _write(_partition_columns(streams, start_dates), "streams", out_dir, fmt)
+        counts["streams"] = streams.num_rows
+
+    if own_conn:
+        conn.close()
+    return counts
+
+
+def read_snapshot(name: str, columns: list[str] = None, years: list[int] = None,
+                  fmt: str = "arrow", snapshot_dir=SNAPSHOT_DIR) -> pa.Table:
+    # Files are memory-mapped and only the requested columns (and the
+    # year partitions asked for) are touched. Arrow IPC is read zero-copy;
+    # Parquet still has to decode the projected column chunks.
+    dataset = ds.dataset(
+        str(snapshot_dir / name),
+        format=FORMATS[fmt],
+        partitioning="hive",
+        filesystem=pafs.LocalFileSystem(use_mmap=True),
+    )
+    year_filter = ds.field("year").isin(years) if years else None
+    return dataset.to_table(columns=columns, filter=year_filter)
@@ -5,15 +5,56 @@ import requests
 import json
 
 DB_PATH = Path(__file__).resolve().parents[2] / "data" / "strava.db"
+_schema_ready = False
 
 def create_db():
     conn = sqlite3.connect(DB_PATH)
     conn.execute("CREATE TABLE IF NOT EXISTS activities (id INTEGER PRIMARY KEY, name TEXT, distance REAL, moving_time INTEGER, elapsed_time INTEGER, total_elevation_gain REAL, start_date TEXT, average_hr REAL, max_hr REAL, average_speed REAL, max_speed REAL, calories REAL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS streams (activity_id INTEGER, type TEXT, data TEXT, PRIMARY KEY (activity_id, type))")
+    conn.execute("CREATE TABLE IF NOT EXISTS best_efforts (activity_id INTEGER, curve TEXT, data TEXT, PRIMARY KEY (activity_id, curve))")
+    conn.execute("CREATE TABLE IF NOT EXISTS best_effort_envelope (curve TEXT, key REAL, value REAL, activity_id INTEGER, PRIMARY KEY (curve, key))")
+    conn.execute("CREATE TABLE IF NOT EXISTS archive_index (activity_id INTEGER PRIMARY KEY, segment TEXT, offset INTEGER, length INTEGER)")
+    conn.execute("CREATE TABLE IF NOT EXISTS activity_intervals (activity_id INTEGER PRIMARY KEY, start_ts INTEGER, end_ts INTEGER, duplicate_of INTEGER)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_activity_intervals_start ON activity_intervals (start_ts)")
+    conn.execute("CREATE TABLE IF NOT EXISTS activity_routes (activity_id INTEGER PRIMARY KEY, polyline TEXT, route_id INTEGER)")
+    conn.execute("CREATE TABLE IF NOT EXISTS routes (route_id INTEGER PRIMARY KEY AUTOINCREMENT, start_cell TEXT, signature TEXT, length REAL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_routes_start_cell ON routes (start_cell)")
+    conn.execute("CREATE TABLE IF NOT EXISTS quantile_sketches (scope TEXT, metric TEXT, data TEXT, PRIMARY KEY (scope, metric))")
+    conn.execute("CREATE TABLE IF NOT EXISTS activity_zones (activity_id INTEGER PRIMARY KEY, hr_z1 REAL, hr_z2 REAL, hr_z3 REAL, hr_z4 REAL, hr_z5 REAL, pace_z1 REAL, pace_z2 REAL, pace_z3 REAL, pace_z4 REAL, pace_z5 REAL, pace_z6 REAL)")
+    # Recreated every time so older databases pick up definition changes;
+    # flagged duplicates are left out (see utils.duplicates.NOT_DUPLICATE)
+    conn.execute("DROP VIEW IF EXISTS weekly_zones")
+    conn.execute("""
+        CREATE VIEW weekly_zones AS
+        SELECT
+            DATE(a.start_date, 'weekday 0', '-6 days') AS week_start,
+            SUM(z.hr_z1) AS hr_z1, SUM(z.hr_z2) AS hr_z2, SUM(z.hr_z3) AS hr_z3,
+            SUM(z.hr_z4) AS hr_z4, SUM(z.hr_z5) AS hr_z5,
+            SUM(z.pace_z1) AS pace_z1, SUM(z.pace_z2) AS pace_z2, SUM(z.pace_z3) AS pace_z3,
+            SUM(z.pace_z4) AS pace_z4, SUM(z.pace_z5) AS pace_z5, SUM(z.pace_z6) AS pace_z6
+        FROM activity_zones z
+        JOIN activities a ON a.id = z.activity_id
+        WHERE a.id NOT IN (SELECT activity_id FROM activity_intervals WHERE duplicate_of IS NOT NULL)
+        GROUP BY week_start
+    """)
+    conn.commit()
     conn.close()
 
 
-def save_activities(parsed_activities):
-    conn = sqlite3.connect(DB_PATH)
+def connect():
+    # Every loader goes through here, so databases created before the
+    # derived tables existed get them on first use, once per process
+    global _schema_ready
+    if not _schema_ready:
+        create_db()
+        _schema_ready = True
+    return sqlite3.connect(DB_PATH)
+
+
+def save_activities(parsed_activities, conn=None, replace=False):
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
 
     flattened = [
     (
@@ -33,13 +74,25 @@ def save_activities(parsed_activities):
     for a in parsed_activities
     ]
 
-    conn.executemany("""INSERT OR IGNORE INTO activities
+    # Only write rows that are new, or differ when replacing, and return
+    # their IDs so callers can skip activities they already have
+    existing = {}
+    for i in range(0, len(flattened), 500):
+        chunk = [row[0] for row in flattened[i:i + 500]]
+        existing.update((row[0], row) for row in conn.execute(f"""SELECT id, name, distance, moving_time, elapsed_time,
+            total_elevation_gain, start_date, average_hr, max_hr, average_speed, max_speed, calories
+            FROM activities WHERE id IN ({', '.join('?' for _ in chunk)})""", chunk))
+    changed = [row for row in flattened if row[0] not in existing or (replace and existing[row[0]] != row)]
+
+    conn.executemany("""INSERT OR REPLACE INTO activities
         (id, name, distance, moving_time, elapsed_time,
          total_elevation_gain, start_date, average_hr,
          max_hr, average_speed, max_speed, calories)
-         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", flattened)
-    conn.commit()
-    conn.close()
+         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", changed)
+    if own_conn:
+        conn.commit()
+        conn.close()
+    return {row[0] for row in changed}
 
 def get_activities(token, after=None):
     headers = {'Authorization': f'Bearer {token}'}
@@ -62,9 +115,18 @@ def get_activities(token, after=None):
         params['page'] += 1
     return all_activities
 
+def get_activity(token, activity_id):
+    headers = {'Authorization': f'Bearer {token}'}
+    response = requests.get(
+        f'https://www.strava.com/api/v3/activities/{activity_id}',
+        headers=headers
+    )
+    response.raise_for_status()
+    return response.json()
+
 def get_new_activities(token):
     # Step 1: Get existing IDs from the DB
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect()
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM activities")
     existing_ids = {row[0] for row in cursor.fetchall()}
@@ -97,3 +159,36 @@ def get_new_activities(token):
 
     return new_activities
 
+def get_activity_streams(token, activity_id):
+    headers = {'Authorization': f'Bearer {token}'}
+    params = {'keys': 'time,distance,heartrate,velocity_smooth,altitude', 'key_by_type': 'true'}
+    response = requests.get(
+        f'https://www.strava.com/api/v3/activities/{activity_id}/streams',
+        headers=headers,
+        params=params
+    )
+    response.raise_for_status()
+    return {stream_type: stream['data'] for stream_type, stream in response.json().items()}
+
+def save_streams(activity_id, streams, conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    conn.executemany(
+        "INSERT OR REPLACE INTO streams (activity_id, type, data) VALUES (?, ?, ?)",
+        [(activity_id, stream_type, json.dumps(data)) for stream_type, data in streams.items()]
+    )
+    if own_conn:
+        conn.commit()
+        conn.close()
+
+def load_streams(activity_id, conn=None) -> dict:
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    rows = conn.execute("SELECT type, data FROM streams WHERE activity_id = ?", (activity_id,)).fetchall()
+    if own_conn:
+        conn.close()
+    return {stream_type: json.loads(data) for stream_type, data in rows}
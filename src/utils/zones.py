@@ -0,0 +1,104 @@
+import numpy as np
+from utils.strava_db import connect
+from utils.hr import get_baseline_hr
+
+# Lower edge of HR zones 2-5 as a fraction of heart-rate reserve (Karvonen).
+# Anything under zone 2 counts as zone 1.
+HR_ZONE_EDGES = [0.6, 0.7, 0.8, 0.9]
+
+# Lower edge of pace zones 2-6 as a fraction of the baseline average speed
+PACE_ZONE_EDGES = [0.8, 0.9, 1.0, 1.1, 1.2]
+
+MAX_SAMPLE_GAP = 5  # seconds; longer gaps are pauses and only count this much
+
+HR_COLUMNS = [f"hr_z{i}" for i in range(1, len(HR_ZONE_EDGES) + 2)]
+PACE_COLUMNS = [f"pace_z{i}" for i in range(1, len(PACE_ZONE_EDGES) + 2)]
+ZONE_COLUMNS = HR_COLUMNS + PACE_COLUMNS  # must match activity_zones in strava_db.create_db
+
+
+def zone_edges(baseline: dict) -> tuple[np.ndarray, np.ndarray]:
+    max_hr, resting_hr = get_baseline_hr(baseline)
+    hr_edges = resting_hr + (max_hr - resting_hr) * np.array(HR_ZONE_EDGES)
+    pace_edges = baseline["avg_speed"] * np.array(PACE_ZONE_EDGES)
+    return hr_edges, pace_edges
+
+
+def compute_zones(streams: dict, baseline: dict) -> dict:
+    if not streams.get("time") or len(streams["time"]) < 2:
+        return {}
+
+    time = np.asarray(streams["time"], dtype=np.float64)
+    dt = np.minimum(np.diff(time), MAX_SAMPLE_GAP)
+    hr_edges, pace_edges = zone_edges(baseline)
+
+    # One digitize + bincount per stream; each sample is weighted by the
+    # seconds until the next one.
+    zones = {}
+    if streams.get("heartrate"):
+        hr = np.asarray(streams["heartrate"], dtype=np.float64)[:-1]
+        seconds = np.bincount(np.digitize(hr, hr_edges), weights=dt, minlength=len(HR_COLUMNS))
+        zones.update(zip(HR_COLUMNS, seconds.tolist()))
+
+    if streams.get("velocity_smooth"):
+        speed = np.asarray(streams["velocity_smooth"], dtype=np.float64)[:-1]
+    elif streams.get("distance"):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speed = np.nan_to_num(np.diff(np.asarray(streams["distance"], dtype=np.float64)) / np.diff(time))
+    else:
+        speed = None
+
+    if speed is not None:
+        seconds = np.bincount(np.digitize(speed, pace_edges), weights=dt, minlength=len(PACE_COLUMNS))
+        zones.update(zip(PACE_COLUMNS, seconds.tolist()))
+
+    return zones
+
+
+def save_zones(activity_id: int, zones: dict, conn=None):
+    if not zones:
+        return
+
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    values = [zones.get(c) for c in ZONE_COLUMNS]
+    conn.execute(
+        f"INSERT OR REPLACE INTO activity_zones (activity_id, {', '.join(ZONE_COLUMNS)}) "
+        f"VALUES (?, {', '.join('?' for _ in ZONE_COLUMNS)})",
+        [activity_id] + values
+    )
+    if own_conn:
+        conn.commit()
+        conn.close()
+
+
+def load_zones(activity_id: int, conn=None) -> dict | None:
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    row = conn.execute(
+        f"SELECT {', '.join(ZONE_COLUMNS)} FROM activity_zones WHERE activity_id = ?",
+        (activity_id,)
+    ).fetchone()
+    if own_conn:
+        conn.close()
+    return dict(zip(ZONE_COLUMNS, row)) if row else None
+
+
+def load_weekly_zones(conn=None) -> list[dict]:
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    rows = conn.execute(f"SELECT week_start, {', '.join(ZONE_COLUMNS)} FROM weekly_zones ORDER BY week_start").fetchall()
+    if own_conn:
+        conn.close()
+    return [dict(zip(["week_start"] + ZONE_COLUMNS, row)) for row in rows]
+
+
+def format_zones(zones: dict) -> str:
+    hr = " | ".join(f"Z{i + 1} {zones[c] / 60:.0f}m" for i, c in enumerate(HR_COLUMNS) if zones.get(c) is not None)
+    pace = " | ".join(f"Z{i + 1} {zones[c] / 60:.0f}m" for i, c in enumerate(PACE_COLUMNS) if zones.get(c) is not None)
+    return f"HR zones: {hr or 'N/A'}\n    Pace zones: {pace or 'N/A'}"
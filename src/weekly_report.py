@@ -0,0 +1,207 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+from plot_daily_averages import load_config, style_plot
+from run_analyzer import load_baseline
+from utils.strava_db import DB_PATH, connect
+from utils.duplicates import NOT_DUPLICATE
+from utils.fitting import fit_trend
+from utils.zones import HR_COLUMNS, PACE_COLUMNS, load_weekly_zones
+
+REPORTS_DIR = DB_PATH.parents[1] / "reports"
+MANIFEST_FILE = REPORTS_DIR / "manifest.json"
+REPORT_VERSION = 1    # bump when the layout changes to force a rebuild
+TREND_WEEKS = 8       # trailing window for the pace trend on each report
+
+_theme = None
+_figure = None
+_axes = None
+
+
+def load_weekly_runs() -> pd.DataFrame:
+    conn = connect()
+    df = pd.read_sql_query(f"""
+        SELECT
+            id, name, start_date,
+            DATE(start_date) AS day,
+            DATE(start_date, 'weekday 0', '-6 days') AS week_start,
+            distance / 1000.0 AS distance_km,
+            moving_time / 60.0 AS moving_min,
+            moving_time / (distance / 1000.0) / 60.0 AS pace_min_per_km,
+            average_hr, total_elevation_gain
+        FROM activities
+        WHERE distance > 1000 AND {NOT_DUPLICATE}
+        ORDER BY start_date
+    """, conn)
+    conn.close()
+    return df
+
+
+def pace_trends(df: pd.DataFrame, weeks: list[str]) -> dict:
+    # One batched robust fit for every week's trailing window: each row is
+    # one week's series, NaN-padded to the longest window.
+    days = pd.to_datetime(df["day"]).values.astype("datetime64[D]").astype(float)
+    week_starts = np.array(pd.to_datetime(weeks).values.astype("datetime64[D]").astype(float))
+    windows = [np.flatnonzero((days >= ws - 7 * (TREND_WEEKS - 1)) & (days < ws + 7)) for ws in week_starts]
+
+    width = max((len(w) for w in windows), default=0)
+    if width < 2:
+        return {}
+    x = np.full((len(weeks), width), np.nan)
+    y = np.full((len(weeks), width), np.nan)
+    w = np.zeros((len(weeks), width))
+    for row, idx in enumerate(windows):
+        x[row, :len(idx)] = days[idx]
+        y[row, :len(idx)] = df["pace_min_per_km"].values[idx]
+        w[row, :len(idx)] = df["distance_km"].values[idx]
+
+    coeffs = fit_trend(x, y, 1, "huber", w)
+    return {week: coeffs[i].tolist() for i, week in enumerate(weeks) if len(windows[i]) >= 2}
+
+
+def build_inputs(df: pd.DataFrame, zones: dict, trends: dict, baseline: dict) -> dict:
+    inputs = {}
+    for week, runs in df.groupby("week_start"):
+        inputs[week] = {
+            "week_start": week,
+            "runs": runs[["id", "name", "day", "distance_km", "moving_min", "pace_min_per_km",
+                          "average_hr", "total_elevation_gain"]].to_dict("records"),
+            "zones": zones.get(week),
+            "trend": trends.get(week),
+            "baseline": {k: baseline.get(k) for k in ("avg_distance", "avg_speed", "avg_heart_rate")} if baseline else None,
+        }
+    return inputs
+
+
+def input_hash(payload: dict, theme: dict) -> str:
+    blob = json.dumps({"version": REPORT_VERSION, "theme": theme, "payload": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _init_worker(theme: dict):
+    # Style once per worker and keep one figure around; every report just
+    # clears and redraws the same axes instead of restyling a new figure.
+    global _theme, _figure, _axes
+    _theme = theme
+    style_plot(theme)
+    _figure, _axes = plt.subplots(2, 2, figsize=(11.69, 8.27))  # A4 landscape
+
+
+def render_week(payload: dict, out_path: str) -> str:
+    theme = _theme
+    runs = pd.DataFrame(payload["runs"])
+    days = pd.to_datetime(runs["day"])
+    for ax in _axes.flat:
+        ax.cla()
+        ax.grid(True, linestyle="--", linewidth=0.5)
+
+    _figure.suptitle(f"Week of {payload['week_start']}", fontsize=16, color=theme["text_color"])
+
+    # Daily distance
+    ax = _axes[0, 0]
+    daily = runs.groupby(days)["distance_km"].sum()
+    ax.bar(daily.index, daily.values, color=theme["accent_color"], alpha=theme["alpha"])
+    ax.set_title("Distance (km)")
+    ax.tick_params(axis="x", rotation=45)
+
+    # Pace with the trailing robust trend
+    ax = _axes[0, 1]
+    ax.plot(days, runs["pace_min_per_km"], linestyle="none", marker=theme["marker"], color=theme["marker_color"])
+    if payload["trend"]:
+        x = days.values.astype("datetime64[D]").astype(float)
+        ax.plot(days, np.polyval(payload["trend"], x), color=theme["trend_line_color"],
+                linestyle=theme["trend_line_style"], linewidth=theme["trend_line_width"])
+        ax.set_title(f"Pace (min/km), {TREND_WEEKS}-week trend {payload['trend'][0] * 7:+.2f} min/km per week")
+    else:
+        ax.set_title("Pace (min/km)")
+    ax.tick_params(axis="x", rotation=45)
+
+    # Time in zones
+    ax = _axes[1, 0]
+    zones = payload["zones"] or {}
+    labels = [c.replace("_", " ").upper() for c in HR_COLUMNS + PACE_COLUMNS]
+    minutes = [(zones.get(c) or 0) / 60 for c in HR_COLUMNS + PACE_COLUMNS]
+    ax.barh(labels, minutes, color=[theme["trend_line_color"]] * len(HR_COLUMNS) + [theme["curve_fit_color"]] * len(PACE_COLUMNS))
+    ax.set_title("Time in zones (min)" if zones else "Time in zones (no stream data)")
+
+    # Summary against baseline
+    ax = _axes[1, 1]
+    ax.axis("off")
+    lines = [
+        f"Runs: {len(runs)}",
+        f"Distance: {runs['distance_km'].sum():.1f} km",
+        f"Moving time: {runs['moving_min'].sum():.0f} min",
+        f"Elevation gain: {runs['total_elevation_gain'].sum():.0f} m",
+        f"Average pace: {runs['moving_min'].sum() / runs['distance_km'].sum():.2f} min/km",
+    ]
+    if runs["average_hr"].notna().any():
+        lines.append(f"Average HR: {runs['average_hr'].mean():.0f} bpm")
+    baseline = payload["baseline"]
+    if baseline and baseline.get("avg_distance"):
+        lines.append(f"Δ avg distance vs baseline: {runs['distance_km'].mean() - baseline['avg_distance'] / 1000:+.2f} km")
+    if baseline and baseline.get("avg_heart_rate") and runs["average_hr"].notna().any():
+        lines.append(f"Δ avg HR vs baseline: {runs['average_hr'].mean() - baseline['avg_heart_rate']:+.1f} bpm")
+    ax.text(0.0, 1.0, "\n".join(lines), va="top", fontsize=13, color=theme["text_color"])
+
+    _figure.tight_layout(rect=[0, 0, 1, 0.95])
+    with PdfPages(out_path) as pdf:
+        pdf.savefig(_figure, facecolor=theme["background_color"])
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser("Build one PDF summary per training week")
+    parser.add_argument("--out", type=str, help="Output directory", default=str(REPORTS_DIR))
+    parser.add_argument("--workers", type=int, help="Worker processes", default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="Rebuild every week, even if unchanged")
+    args = parser.parse_args()
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_file = out_dir / MANIFEST_FILE.name
+    manifest = json.loads(manifest_file.read_text()) if manifest_file.exists() else {}
+
+    theme = load_config()["theme"]
+    df = load_weekly_runs()
+    if df.empty:
+        print("No runs found.")
+        return
+
+    weeks = sorted(df["week_start"].unique())
+    zones = {z["week_start"]: z for z in load_weekly_zones()}
+    inputs = build_inputs(df, zones, pace_trends(df, weeks), load_baseline())
+
+    # Skip weeks whose inputs hash the same as at the last build
+    hashes = {week: input_hash(payload, theme) for week, payload in inputs.items()}
+    todo = [
+        week for week in weeks
+        if args.force or manifest.get(week) != hashes[week] or not (out_dir / f"week_{week}.pdf").exists()
+    ]
+    print(f"{len(weeks)} weeks, {len(weeks) - len(todo)} unchanged, building {len(todo)}.")
+    if not todo:
+        return
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(theme,)) as pool:
+        futures = {week: pool.submit(render_week, inputs[week], str(out_dir / f"week_{week}.pdf")) for week in todo}
+        for week, future in futures.items():
+            try:
+                future.result()
+                manifest[week] = hashes[week]
+            except Exception as e:
+                print(f"Failed to build week {week}: {e}")
+
+    manifest_file.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    print(f"Reports written to {out_dir}")
+
+
+if __name__ == "__main__":
+    main()